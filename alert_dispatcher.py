@@ -0,0 +1,94 @@
+import asyncio
+import time
+import numpy as np
+from aiogram.exceptions import TelegramRetryAfter, TelegramAPIError
+from metrics import alerts_sent
+
+class TokenBucket:
+    """
+    Async token bucket: allows `rate` acquisitions per second with bursts of up to `capacity`.
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AlertDispatcher:
+    """
+    Sends each cycle's alerts as one merged message per chat, to many chats concurrently.
+    Sending is throttled by a global token bucket and a per-chat token bucket that follow
+    Telegram's limits (about 30 messages/second overall and 1 message/second per chat),
+    and a 429 response is retried after the delay Telegram asks for.
+    """
+    def __init__(self, bot, global_rate=30, per_chat_rate=1, max_retries=3, max_concurrency=50):
+        self.bot = bot
+        self.per_chat_rate = per_chat_rate
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_buckets = {}
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    def chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.per_chat_rate)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def send(self, chat_id, message):
+        """
+        Sends one message, retrying on 429 with backoff. Returns the delivery latency in seconds,
+        or None if the message could not be delivered.
+        """
+        started = time.monotonic()
+        async with self.semaphore:
+            for attempt in range(self.max_retries + 1):
+                await self.chat_bucket(chat_id).acquire()
+                await self.global_bucket.acquire()
+                try:
+                    await self.bot.send_message(chat_id, message)
+                    return time.monotonic() - started
+                except TelegramRetryAfter as e:
+                    if attempt == self.max_retries:
+                        break
+                    await asyncio.sleep(e.retry_after * (2 ** attempt))
+                except TelegramAPIError as e:
+                    print(f"Failed to send alert to {chat_id}: {e}")
+                    return None
+        print(f"Gave up sending alert to {chat_id} after {self.max_retries} retries")
+        return None
+
+    async def dispatch(self, chat_ids, message_list):
+        """
+        Merges the messages into one per chat and sends them concurrently.
+        Returns a delivery report with counts and latency percentiles in seconds.
+        """
+        report = {"sent": 0, "failed": 0, "p50": None, "p95": None, "max": None}
+        if not message_list or not chat_ids:
+            return report
+        message = "\n".join(message_list)
+        latencies = await asyncio.gather(*(self.send(chat_id, message) for chat_id in chat_ids))
+        delivered = np.array([latency for latency in latencies if latency is not None])
+        report["sent"] = len(delivered)
+        report["failed"] = len(latencies) - len(delivered)
+        alerts_sent.inc(report["sent"], result="sent")
+        alerts_sent.inc(report["failed"], result="failed")
+        if len(delivered):
+            report["p50"] = float(np.percentile(delivered, 50))
+            report["p95"] = float(np.percentile(delivered, 95))
+            report["max"] = float(delivered.max())
+        return report
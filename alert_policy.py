@@ -0,0 +1,81 @@
+import time
+from collections import namedtuple
+
+AlertState = namedtuple('AlertState', ['sent_at', 'depletion'])
+
+class AlertPolicy:
+    """
+    Decides which chats get an alert for a tank in this cycle, with one state per (tank, chat).
+    A tank is low when its fullness is under the fullness threshold or its forecast runs out within
+    the depletion threshold. A low tank is alerted once, then again only after `realert_minutes`
+    or when the time to depletion shrinks by `escalation_ratio` since the last alert. The state is
+    cleared only once the tank is comfortably above both thresholds (hysteresis), so a reading
+    hovering around a threshold does not re-trigger alerts.
+    """
+    def __init__(self, fullness_threshold, depletion_threshold, realert_minutes,
+                 fullness_hysteresis=5.0, depletion_hysteresis=0.2, escalation_ratio=0.5):
+        self.fullness_threshold = fullness_threshold
+        self.depletion_threshold = depletion_threshold
+        self.realert_seconds = realert_minutes * 60
+        self.fullness_hysteresis = fullness_hysteresis
+        self.depletion_hysteresis = depletion_hysteresis
+        self.escalation_ratio = escalation_ratio
+        self.states = {}  # tank -> {chat_id: AlertState}
+        self.summaries = {}  # tank -> (quiet_until, escalate_at), skips the per-chat loop when nothing is due
+
+    def depleting_soon(self, depletion):
+        return depletion is not None and depletion < self.depletion_threshold
+
+    def is_low(self, fullness, depletion):
+        return fullness < self.fullness_threshold or self.depleting_soon(depletion)
+
+    def is_clear(self, fullness, depletion):
+        return (fullness >= self.fullness_threshold + self.fullness_hysteresis
+                and (depletion is None or depletion >= self.depletion_threshold * (1 + self.depletion_hysteresis)))
+
+    def evaluate(self, tank, fullness, depletion, chat_ids, now=None):
+        """
+        Returns [(chat_id, reason)] for the chats to alert about this tank, reason being
+        'new', 'escalated' or 'reminder', and records them as alerted. `chat_ids` is a set.
+        """
+        now = time.time() if now is None else now
+        if not self.is_low(fullness, depletion):
+            if self.is_clear(fullness, depletion):
+                self.states.pop(tank, None)
+                self.summaries.pop(tank, None)
+            return []
+        # Only a forecast under the threshold counts towards escalation
+        depletion = depletion if self.depleting_soon(depletion) else None
+        tank_states = self.states.setdefault(tank, {})
+        summary = self.summaries.get(tank)
+        if (summary is not None and now < summary[0] and (depletion is None or depletion > summary[1])
+                and tank_states.keys() >= chat_ids):
+            return []
+        due = []
+        for chat_id in chat_ids:
+            state = tank_states.get(chat_id)
+            if state is None:
+                reason = 'new'
+            elif depletion is not None and (state.depletion is None
+                                            or depletion <= state.depletion * (1 - self.escalation_ratio)):
+                reason = 'escalated'
+            elif now - state.sent_at >= self.realert_seconds:
+                reason = 'reminder'
+            else:
+                continue
+            tank_states[chat_id] = AlertState(now, depletion)
+            due.append((chat_id, reason))
+        if due or summary is None:
+            self.summaries[tank] = self.summarize(tank_states)
+        return due
+
+    def summarize(self, tank_states):
+        # Earliest reminder, and the forecast that would escalate at least one chat
+        quiet_until = min(state.sent_at for state in tank_states.values()) + self.realert_seconds
+        escalate_at = max(float('inf') if state.depletion is None else state.depletion * (1 - self.escalation_ratio)
+                          for state in tank_states.values())
+        return quiet_until, escalate_at
+
+    def clear(self):
+        self.states.clear()
+        self.summaries.clear()
@@ -0,0 +1,80 @@
+"""
+Start-up benchmark for the dashboard and bot processes.
+
+Each measurement runs in a fresh interpreter and reports the import time of the module,
+the time until the first dashboard request is served, and the peak RSS of the process.
+Results are printed and can be appended as JSON lines to a history file to track releases:
+
+    python benchmark_startup.py --repeat 5 --output startup_history.jsonl
+"""
+import argparse
+import json
+import subprocess
+import sys
+from datetime import datetime
+
+# Run inside the child interpreter; prints one JSON object
+DASHBOARD_PROBE = '''
+import json, resource, time
+started = time.perf_counter()
+import http_server
+imported = time.perf_counter()
+client = http_server.app.test_client()
+with client.session_transaction() as session:
+    session["username"] = "benchmark"
+response = client.get("/main")
+served = time.perf_counter()
+print(json.dumps({
+    "import_s": imported - started,
+    "first_request_s": served - started,
+    "status": response.status_code,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+'''
+
+BOT_PROBE = '''
+import json, resource, time
+started = time.perf_counter()
+import server
+imported = time.perf_counter()
+print(json.dumps({
+    "import_s": imported - started,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+'''
+
+def run_probe(code):
+    result = subprocess.run([sys.executable, "-W", "ignore", "-c", code], capture_output=True, text=True, check=True)
+    # The modules print while importing, the measurement is the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def summarize(samples):
+    summary = {}
+    for key in samples[0]:
+        values = sorted(sample[key] for sample in samples)
+        if isinstance(values[0], float):
+            summary[key] = {"min": values[0], "median": values[len(values) // 2], "max": values[-1]}
+        else:
+            summary[key] = values[-1]
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="append the results as a JSON line to this file")
+    args = parser.parse_args()
+
+    # Warm the bytecode cache so the first sample is not an outlier
+    run_probe(BOT_PROBE)
+    record = {"timestamp": datetime.now().isoformat(timespec="seconds")}
+    for name, probe in (("dashboard", DASHBOARD_PROBE), ("bot", BOT_PROBE)):
+        samples = [run_probe(probe) for _ in range(args.repeat)]
+        record[name] = summarize(samples)
+        print(f"{name}: {json.dumps(record[name], indent=2)}")
+
+    if args.output:
+        with open(args.output, "a") as file:
+            file.write(json.dumps(record) + "\n")
+
+if __name__ == "__main__":
+    main()
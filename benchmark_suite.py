@@ -0,0 +1,288 @@
+"""
+Benchmark suite for the forecasting, alerting, dashboard, login and polling hot paths.
+
+Runs offline: the real model/*.pkl files are used and the Raspberry Pi is replaced by the local
+stand-in from pi_standin.py. Every benchmark reports latency percentiles and calls per second.
+
+    python benchmark_suite.py --save-baseline      # record the baseline of this machine
+    python benchmark_suite.py                      # compare against it, exit code 1 on regression
+
+A benchmark regresses when its median latency exceeds the baseline median times --tolerance.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+
+STANDIN_PORT = 5901
+FULLNESS_LEVELS = [1, 10, 25, 50, 100, 250]
+TANK_COUNTS = [4, 64, 512]
+SITE_COUNTS = [1, 24]
+FLEET_SIZE = 2048
+
+def summarize(samples):
+    samples = np.array(samples)
+    return {
+        "p50": float(np.percentile(samples, 50)),
+        "p95": float(np.percentile(samples, 95)),
+        "p99": float(np.percentile(samples, 99)),
+        "calls_per_s": float(len(samples) / samples.sum()) if samples.sum() > 0 else float("inf"),
+    }
+
+def measure(func, iterations, warmup=3, setup=None):
+    for _ in range(warmup):
+        if setup:
+            setup()
+        func()
+    samples = []
+    for _ in range(iterations):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+def measure_async(loop, coroutine_func, iterations, warmup=3):
+    return measure(lambda: loop.run_until_complete(coroutine_func()), iterations, warmup)
+
+def prepare_workdir():
+    # The modules read config.txt, fullness.txt and model/ from the working directory
+    workdir = tempfile.mkdtemp(prefix="benchmark_")
+    shutil.copytree(os.path.join(REPO_DIR, "model"), os.path.join(workdir, "model"))
+    shutil.copy(os.path.join(REPO_DIR, "fullness.txt"), workdir)
+    with open(os.path.join(REPO_DIR, "config.txt"), 'r') as file:
+        config = file.read()
+    config = config.replace("ip = ", "ip = 127.0.0.1\n#ip = ", 1).replace("port_num = ", f"port_num = {STANDIN_PORT}\n#port_num = ", 1)
+    with open(os.path.join(workdir, "config.txt"), 'w') as file:
+        file.write(config)
+    os.chdir(workdir)
+    return workdir
+
+def storage_tanks(count):
+    # Synthetic fleet cycling through the real model files
+    return [{"tag": f'"Tank{i + 1}"', "model": f"model{i % 4 + 1}.pkl", "depth": 10.0} for i in range(count)]
+
+def site_info(site_id, count):
+    # Every site is served by the stand-in
+    return {"id": site_id, "name": site_id, "ip": "127.0.0.1", "port_num": STANDIN_PORT,
+            "storage_tanks": storage_tanks(count)}
+
+
+class FakeTelegramBot:
+    async def send_message(self, chat_id, message):
+        return None
+
+
+def run_benchmarks(iterations, name_filter=None):
+    import server
+    import http_server
+    from model_socket import ModelRegistry, predict_useuptime, forecast_cache, forecast_all
+    from forecast_pool import ForecastPool
+    from fullness_store import fullness_store
+    from alert_dispatcher import AlertDispatcher
+    from alert_policy import AlertPolicy
+    from pi_client import PiClient
+    from site_poller import Site, SitePoller
+
+    results = {}
+
+    def wanted(name):
+        return name_filter is None or name_filter in name
+
+    # Forecasting: the cache is cleared so every call computes the depletion time
+    registry = ModelRegistry(storage_tanks(4))
+    registry.load_all()
+    model = registry.get('"Tank1"')
+    for level in FULLNESS_LEVELS:
+        name = f"predict_useuptime[{level}]"
+        if wanted(name):
+            results[name] = measure(lambda: predict_useuptime(level, model, False), iterations * 10,
+                                    setup=forecast_cache.clear)
+
+    # Alerting for fleets of N tanks
+    for count in TANK_COUNTS:
+        name = f"handle_alert_message[{count}]"
+        if not wanted(name):
+            continue
+        bot = object.__new__(server.TelegramBot)
+        site = Site(site_info("main", count), default=True)
+        site.model_registry.load_all()
+        bot.sites = [site]
+        bot.forecast_pool = None
+        bot.fullness_alert_threshold = 20
+        bot.depletion_alert_threshold = 100
+        # 100 chats in the steady state: every low tank has been alerted already
+        bot.chat_ids = set(range(100))
+        bot.alert_policy = AlertPolicy(20, 100, 20)
+        tanks = storage_tanks(count)
+        fullness_store.update([tank["tag"] for tank in tanks], list(np.linspace(1, 100, count)))
+        loop = asyncio.new_event_loop()
+        results[name] = measure(lambda: loop.run_until_complete(bot.handle_alert_message(site)), iterations,
+                                setup=forecast_cache.clear)
+        loop.close()
+
+    # Forecasting a large fleet in this process and sharded across a process pool, a new minute per call
+    # so neither the local nor the workers' forecast caches answer it
+    fleet = storage_tanks(FLEET_SIZE)
+    fleet_names = [tank["tag"] for tank in fleet]
+    fleet_fullness = list(np.linspace(1, 300, FLEET_SIZE))
+    fleet_registry = ModelRegistry(fleet)
+    minutes = itertools.count(1)
+
+    def next_minute():
+        return datetime(2026, 1, 4) + timedelta(minutes=next(minutes))
+
+    if wanted(f"forecast_fleet[{FLEET_SIZE}]"):
+        fleet_registry.load_all()
+        results[f"forecast_fleet[{FLEET_SIZE}]"] = measure(
+            lambda: forecast_all(fleet_fullness, fleet_registry.models_for(fleet_names), next_minute(), fleet_names),
+            iterations)
+    if wanted(f"forecast_fleet_pool[{FLEET_SIZE}]"):
+        # The workers print outside the report's stdout redirect
+        pool = ForecastPool({"main": fleet}, quiet=True)
+        pool.warm_up()
+        results[f"forecast_fleet_pool[{FLEET_SIZE}]"] = measure(
+            lambda: pool.forecast("main", fleet_fullness, fleet_names, fleet_registry, next_minute()), iterations)
+        pool.close()
+
+    # Dashboard rendering from the forecast snapshot
+    if wanted("dashboard_main"):
+        client = http_server.app.test_client()
+        with client.session_transaction() as session:
+            session["username"] = "benchmark"
+        results["dashboard_main"] = measure(lambda: client.get('/main'), iterations)
+
+    # Login encryption, raw RSA and hybrid, against the stand-in's key
+    data = {"username": "benchmark", "password": "password"}
+    if wanted("encrypt_json"):
+        http_server.hybrid_encryption = False
+        results["encrypt_json"] = measure(lambda: http_server.encrypt_json(data), iterations)
+    if wanted("encrypt_payload_hybrid"):
+        http_server.hybrid_encryption = True
+        results["encrypt_payload_hybrid"] = measure(lambda: http_server.encrypt_payload(data), iterations)
+        http_server.hybrid_encryption = False
+    if wanted("authenticate_user"):
+        results["authenticate_user"] = measure(lambda: http_server.authenticate_user(data), iterations)
+    if wanted("authenticate_user_hybrid"):
+        # After the first login the stand-in uses its cached session key, no RSA on either side
+        http_server.hybrid_encryption = True
+        results["authenticate_user_hybrid"] = measure(lambda: http_server.authenticate_user(data), iterations)
+        http_server.hybrid_encryption = False
+
+    # One periodic_task cycle against a stand-in that returns new readings every time, for one site
+    # and for a fleet of sites polled concurrently
+    for site_count in SITE_COUNTS:
+        name = "poll_cycle" if site_count == 1 else f"poll_cycle_sites[{site_count}]"
+        if not wanted(name):
+            continue
+        loop = asyncio.new_event_loop()
+        bot = object.__new__(server.TelegramBot)
+        bot.interval = 15
+        bot.sites = [Site(site_info("main" if i == 0 else f"site{i}", 4), default=i == 0) for i in range(site_count)]
+        bot.site_poller = SitePoller(bot.sites)
+        bot.forecast_pool = None
+        bot.fullness_alert_threshold = 20
+        bot.depletion_alert_threshold = 100
+        bot.chat_ids = set(range(100))
+        bot.alert_policy = AlertPolicy(20, 100, 20)
+        bot.alert_dispatcher = AlertDispatcher(FakeTelegramBot(), global_rate=1e6, per_chat_rate=1e6)
+        results[name] = measure_async(loop, bot.poll_once, iterations)
+        for site in bot.sites:
+            loop.run_until_complete(site.close())
+        loop.close()
+
+    # Many users logging in through the bot at the same time
+    if wanted("bot_concurrent_logins"):
+        loop = asyncio.new_event_loop()
+        bot = object.__new__(server.TelegramBot)
+        bot.pi = PiClient(f"http://127.0.0.1:{STANDIN_PORT}")
+        bot.public_key = None
+        bot.public_key_lock = asyncio.Lock()
+
+        async def logins():
+            await asyncio.gather(*(bot.authenticate_user(f"user{i}", "password") for i in range(50)))
+
+        results["bot_concurrent_logins[50]"] = measure_async(loop, logins, iterations)
+        loop.run_until_complete(bot.pi.close())
+        loop.close()
+
+    # A burst of occupancy queries, coalesced into one request (no TTL so every iteration hits the Pi)
+    if wanted("who_is_in_burst"):
+        loop = asyncio.new_event_loop()
+        pi = PiClient(f"http://127.0.0.1:{STANDIN_PORT}")
+
+        async def burst():
+            await asyncio.gather(*(pi.get_shared("/who_is_in", 0) for _ in range(50)))
+
+        results["who_is_in_burst[50]"] = measure_async(loop, burst, iterations)
+        loop.run_until_complete(pi.close())
+        loop.close()
+
+    return results
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        if name in baseline and result["p50"] > baseline[name]["p50"] * tolerance:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this text")
+    parser.add_argument("--baseline", default=os.path.join(REPO_DIR, "benchmark_baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=1.5)
+    args = parser.parse_args()
+
+    from pi_standin import create_app, serve_in_thread
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    workdir = prepare_workdir()
+    standin = serve_in_thread(create_app(tanks=4, changing=True), STANDIN_PORT)
+    try:
+        # The code under test prints a lot, keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = run_benchmarks(args.iterations, args.filter)
+    finally:
+        standin.shutdown()
+        os.chdir(REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+    regressions = compare(results, baseline, args.tolerance)
+
+    print(f"{'benchmark':32} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'calls/s':>10} {'baseline p50':>13}")
+    for name, result in results.items():
+        reference = f"{baseline[name]['p50'] * 1000:.3f}" if name in baseline else "-"
+        flag = "  REGRESSION" if name in regressions else ""
+        print(f"{name:32} {result['p50'] * 1000:10.3f} {result['p95'] * 1000:10.3f} "
+              f"{result['p99'] * 1000:10.3f} {result['calls_per_s']:10.1f} {reference:>13}{flag}")
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as file:
+            json.dump(baseline, file, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
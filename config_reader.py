@@ -1,5 +1,7 @@
 import configparser
 
+DEFAULT_SITE = 'main'
+
 class ConfigReader:
     def __init__(self, config_file='config.txt'):
         self.config_file = config_file
@@ -24,18 +26,45 @@ class ConfigReader:
             return value.split(delimiter)
         return []
 
-    def get_storagetank_info(self):
+    def get_storagetank_info(self, site=None):
         """
-        Returns a list of dustbin information from the config.
+        Returns a list of dustbin information from the config, only the tanks of `site` if given.
         """
         storage_tanks = []
         for section in self.config_data:
             if section.startswith("STORAGE_TANK_"):
                 depth = float(self.get_param(section, "depth"))
                 tag = self.get_param(section, "tag")
-                storage_tanks.append({"depth": depth, "tag": tag})
+                # Model file of the tank, model<N>.pkl for STORAGE_TANK_<N> unless set explicitly
+                number = section[len('STORAGE_TANK_'):]
+                model = self.get_param(section, "model") or f"model{number}.pkl"
+                # "pickle" uses the model file, "online" learns from live readings (state kept in online_model)
+                backend = self.get_param(section, "backend") or "pickle"
+                online_model = self.get_param(section, "online_model") or f"online{number}.npz"
+                tank_site = (self.get_param(section, "site") or DEFAULT_SITE).lower()
+                if site is not None and tank_site != site:
+                    continue
+                storage_tanks.append({"depth": depth, "tag": tag, "model": model,
+                                      "backend": backend, "online_model": online_model, "site": tank_site})
         return storage_tanks
 
+    def get_site_info(self):
+        """
+        Returns the sites to poll, the default site first. [RASPI] is the default site and every
+        [SITE_<ID>] section (ip, port_num, name) adds one. A storage tank belongs to the site named
+        by its `site` key, or to the default site.
+        """
+        sites = [{"id": DEFAULT_SITE, "name": self.get_param('RASPI', 'site_name') or DEFAULT_SITE,
+                  "ip": self.get_param('RASPI', 'ip'), "port_num": self.get_param('RASPI', 'port_num'),
+                  "storage_tanks": self.get_storagetank_info(DEFAULT_SITE)}]
+        for section in self.config_data:
+            if section.startswith("SITE_"):
+                site_id = section[len('SITE_'):].lower()
+                sites.append({"id": site_id, "name": self.get_param(section, "name") or site_id,
+                              "ip": self.get_param(section, "ip"), "port_num": self.get_param(section, "port_num"),
+                              "storage_tanks": self.get_storagetank_info(site_id)})
+        return sites
+
     def get_thingspeak_info(self):
         """
         Returns the ThingSpeak read/write API keys and channel IDs.
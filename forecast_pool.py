@@ -0,0 +1,152 @@
+import asyncio
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+from model_socket import NO_MODEL, ModelRegistry, forecast_all, format_minutes, get_rate_table
+
+# Per worker process: site id -> (ModelRegistry, tags in config order)
+_worker_sites = {}
+
+def _init_worker(site_tanks, model_dir, quiet):
+    # Runs once in every worker: load the pickled models and build their rate tables up front
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+    for site_id, storage_tanks in site_tanks.items():
+        registry = ModelRegistry(storage_tanks, model_dir)
+        tags = [tank["tag"] for tank in storage_tanks]
+        for tag in tags:
+            if registry.backends[tag] == "pickle":
+                get_rate_table(registry.get(tag))
+        _worker_sites[site_id] = (registry, tags)
+
+def _forecast_shard(site_id, tank_indices, fullness, now):
+    # Tanks arrive as indices into the site's tag list, results leave as two float64 arrays
+    registry, tags = _worker_sites[site_id]
+    names = [tags[index] for index in tank_indices]
+    # Cached by model object, not tag, so a reloaded model file is forecast from at once
+    roc_list, depletion_list, _ = forecast_all(fullness, registry.models_for(names), now)
+    depletion = np.array([np.nan if minutes is None else minutes for minutes in depletion_list], dtype=np.float64)
+    return np.asarray(roc_list, dtype=np.float64), depletion
+
+
+class ForecastPool:
+    """
+    Forecasts large fleets in a process pool. The pickled-model tanks of a request are split into
+    contiguous shards, one task per worker, and each worker keeps its own copy of every model, loaded
+    once when the worker starts. Tanks are sent as index and fullness arrays and the rate of change
+    and depletion minutes come back as arrays, so a task costs a few kilobytes of pickling.
+
+    Online-model tanks learn from readings in the calling process and are forecast there, as are
+    requests too small to be worth splitting (under `min_tanks_per_worker` pickled tanks).
+    forecast() blocks, forecast_async() can be awaited from the bot's event loop. With `quiet` the
+    workers discard what they print.
+    """
+    def __init__(self, site_tanks, workers=None, min_tanks_per_worker=32, model_dir=None, quiet=False):
+        # site_tanks: site id -> storage tank list, as returned by ConfigReader.get_storagetank_info
+        if model_dir is None:
+            model_dir = os.path.join(os.getcwd(), "model")
+        self.workers = workers or os.cpu_count() or 1
+        self.min_tanks_per_worker = min_tanks_per_worker
+        self.tag_index = {site_id: {tank["tag"]: index for index, tank in enumerate(storage_tanks)}
+                          for site_id, storage_tanks in site_tanks.items()}
+        # Spawned rather than forked, the parent runs event loops and server threads
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker, initargs=(site_tanks, model_dir, quiet))
+
+    def _plan(self, site_id, fullness_list, name_list, registry):
+        """
+        Returns the shards to send to the pool as (positions, tank indices, fullness) and the
+        positions to forecast locally, which include the tanks without a configured model.
+        """
+        tag_index = self.tag_index.get(site_id, {})
+        pooled = [i for i, name in enumerate(name_list) if registry.backends.get(name) == "pickle" and name in tag_index]
+        shard_count = min(self.workers, len(pooled) // self.min_tanks_per_worker)
+        if shard_count < 1:
+            return [], list(range(len(name_list)))
+        pooled_set = set(pooled)
+        local = [i for i in range(len(name_list)) if i not in pooled_set]
+        positions = np.array(pooled, dtype=np.int64)
+        indices = np.array([tag_index[name_list[i]] for i in pooled], dtype=np.int32)
+        fullness = np.asarray(fullness_list, dtype=np.float64)[positions]
+        shards = [(shard_positions, shard_indices, shard_fullness) for shard_positions, shard_indices, shard_fullness
+                  in zip(np.array_split(positions, shard_count), np.array_split(indices, shard_count),
+                         np.array_split(fullness, shard_count))]
+        return shards, local
+
+    def _submit(self, site_id, shards, now):
+        return [self.executor.submit(_forecast_shard, site_id, shard_indices, shard_fullness, now)
+                for _, shard_indices, shard_fullness in shards]
+
+    @staticmethod
+    def _forecast_local(local, fullness_list, name_list, registry, now):
+        names = [name_list[i] for i in local]
+        roc_list, depletion_list, _ = forecast_all([fullness_list[i] for i in local],
+                                                   registry.models_for(names), now)
+        depletion = np.array([np.nan if minutes is None else minutes for minutes in depletion_list], dtype=np.float64)
+        return np.asarray(roc_list, dtype=np.float64), depletion
+
+    @staticmethod
+    def _merge(name_list, registry, parts):
+        # parts: (positions, roc array, depletion array) -> the three lists forecast_all returns
+        roc = np.empty(len(name_list), dtype=np.float64)
+        depletion = np.empty(len(name_list), dtype=np.float64)
+        for positions, part_roc, part_depletion in parts:
+            roc[positions] = part_roc
+            depletion[positions] = part_depletion
+        depletion_list = [None if np.isnan(minutes) else int(minutes) for minutes in depletion]
+        depletion_str_list = [format_minutes(minutes) if name in registry.paths else NO_MODEL
+                              for name, minutes in zip(name_list, depletion_list)]
+        return roc.tolist(), depletion_list, depletion_str_list
+
+    def forecast(self, site_id, fullness_list, name_list, registry, now=None):
+        """
+        Same result as forecast_all for the tanks of one site, `registry` being the site's registry
+        in this process (used for the tanks forecast locally).
+        """
+        now = now or datetime.now()
+        shards, local = self._plan(site_id, fullness_list, name_list, registry)
+        futures = self._submit(site_id, shards, now)
+        parts = []
+        if local:
+            parts.append((local, *self._forecast_local(local, fullness_list, name_list, registry, now)))
+        for (positions, _, _), future in zip(shards, futures):
+            parts.append((positions, *future.result()))
+        return self._merge(name_list, registry, parts)
+
+    async def forecast_async(self, site_id, fullness_list, name_list, registry, now=None):
+        now = now or datetime.now()
+        shards, local = self._plan(site_id, fullness_list, name_list, registry)
+        futures = [asyncio.wrap_future(future) for future in self._submit(site_id, shards, now)]
+        parts = []
+        if local:
+            parts.append((local, *self._forecast_local(local, fullness_list, name_list, registry, now)))
+        results = await asyncio.gather(*futures)
+        for (positions, _, _), result in zip(shards, results):
+            parts.append((positions, *result))
+        return self._merge(name_list, registry, parts)
+
+    def warm_up(self):
+        # One no-op task per worker, so the workers start and load their models before the first request
+        list(self.executor.map(_worker_pid, range(self.workers)))
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _worker_pid(_):
+    return os.getpid()
+
+
+def create_forecast_pool(configReader, site_tanks):
+    """
+    Returns the ForecastPool configured in [FORECAST], or None when `workers` is 0 and
+    forecasts run in the calling process.
+    """
+    workers = int(configReader.get_param('FORECAST', 'workers') or 0)
+    if workers <= 0:
+        return None
+    min_tanks_per_worker = int(configReader.get_param('FORECAST', 'min_tanks_per_worker') or 32)
+    return ForecastPool(site_tanks, workers, min_tanks_per_worker)
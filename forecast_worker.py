@@ -0,0 +1,133 @@
+import json
+import threading
+import time
+from collections import namedtuple
+from model_socket import forecast_all, minute_of_week
+
+# Immutable result of one forecast pass over all tanks
+ForecastSnapshot = namedtuple(
+    "ForecastSnapshot",
+    ["name_list", "fullness_list", "roc_list", "depletion_list", "depletion_str_list", "version", "created_at"],
+)
+
+class ForecastWorker:
+    """
+    Background thread that recomputes the rate of change and depletion time of every tank whenever
+    new fullness data arrives (or the minute changes) and publishes the result as a ForecastSnapshot.
+    Readers only take the latest snapshot, so serving it does not depend on stock levels or tank count.
+    """
+    def __init__(self, model_registry, store, fullness_path='fullness.txt', refresh_interval=5,
+                 forecast_pool=None, site_id='main'):
+        self.model_registry = model_registry
+        self.forecast_pool = forecast_pool  # Shards the forecast across processes when set
+        self.site_id = site_id
+        self.store = store
+        self.fullness_path = fullness_path
+        self.refresh_interval = refresh_interval
+        self.snapshot = None
+        self.snapshot_json = None  # Serialized once per snapshot and shared by every API client
+        self.sequence = 0
+        self._published = threading.Condition()
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._computed_for = None
+        self._observed_version = None
+
+    def refresh(self):
+        """
+        Recomputes the snapshot if the fullness data or the minute changed since the last pass.
+        Returns the current snapshot.
+        """
+        with self._lock:
+            self.store.refresh_from_file(self.fullness_path)
+            key = (self.store.version, minute_of_week())
+            if key == self._computed_for and self.snapshot is not None:
+                return self.snapshot
+            fullness_list, name_list = self.store.snapshot()
+            if self.store.version != self._observed_version:
+                self.model_registry.observe(name_list, fullness_list, self.store.timestamp)
+                self._observed_version = self.store.version
+            if self.forecast_pool is not None:
+                roc_list, depletion_list, depletion_str_list = self.forecast_pool.forecast(
+                    self.site_id, fullness_list, name_list, self.model_registry)
+            else:
+                roc_list, depletion_list, depletion_str_list = forecast_all(
+                    fullness_list, self.model_registry.models_for(name_list))
+            snapshot = ForecastSnapshot(
+                tuple(name_list), tuple(fullness_list), tuple(roc_list), tuple(depletion_list),
+                tuple(depletion_str_list), self.store.version, time.time())
+            self._computed_for = key
+            self._publish(snapshot)
+            return snapshot
+
+    def _publish(self, snapshot):
+        # Publishing is a single reference swap, readers never see a partial update
+        snapshot_json = json.dumps(snapshot_to_dict(snapshot))
+        with self._published:
+            self.snapshot = snapshot
+            self.snapshot_json = snapshot_json
+            self.sequence += 1
+            self._published.notify_all()
+
+    def wait_for_update(self, sequence=None, timeout=15):
+        """
+        Blocks until a snapshot newer than `sequence` is published or the timeout expires.
+        Returns (sequence, snapshot_json), with snapshot_json None on timeout.
+        """
+        with self._published:
+            if not self._published.wait_for(lambda: self.snapshot_json is not None and self.sequence != sequence,
+                                            timeout=timeout):
+                return sequence, None
+            return self.sequence, self.snapshot_json
+
+    def get_snapshot(self):
+        # Computes in the caller only until the worker has published its first snapshot
+        snapshot = self.snapshot
+        if snapshot is None:
+            snapshot = self.refresh()
+        return snapshot
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing forecast: {e}")
+            self._stop.wait(self.refresh_interval)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="forecast-worker", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+def tank_label(name):
+    # Tank names in the fullness data are quoted, e.g. "Grains"
+    return name.strip('"')
+
+def snapshot_to_dict(snapshot):
+    return {
+        "version": snapshot.version,
+        "created_at": snapshot.created_at,
+        "tanks": [
+            {
+                "name": tank_label(name),
+                "fullness": fullness,
+                "roc": roc,
+                "depletion_minutes": depletion,
+                "depletion": depletion_str,
+            }
+            for name, fullness, roc, depletion, depletion_str in zip(
+                snapshot.name_list, snapshot.fullness_list, snapshot.roc_list,
+                snapshot.depletion_list, snapshot.depletion_str_list)
+        ],
+    }
+
+def snapshot_age(snapshot):
+    # Seconds since the snapshot was computed
+    return max(0, int(time.time() - snapshot.created_at))
@@ -0,0 +1,59 @@
+import io
+import os
+import threading
+
+TANK_COLORS = ['blue', 'red', 'green', 'purple']
+# Saved by the bot after each new reading and served as is by the dashboard
+CHART_PATH = 'storagetank_fullness.png'
+
+def render_fullness_chart(name_list, fullness_list):
+    """
+    Renders the "Fullness for Each Tank" bar chart as PNG bytes with matplotlib's Agg backend.
+    """
+    # Imported here so processes that never draw a chart do not pay for matplotlib at start-up
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = Figure(figsize=(6.4, 4.8))
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    colors = [TANK_COLORS[i % len(TANK_COLORS)] for i in range(len(name_list))]
+    axes.bar(name_list, fullness_list, color=colors)
+    axes.set_ylim(0, 100)
+    axes.set_title('Fullness for Each Tank')
+    axes.set_xlabel('Storage Tank')
+    axes.set_ylabel('Current Fullness (%)')
+    axes.grid(True, linestyle='--', linewidth=0.5)
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+class FullnessChart:
+    """
+    Fullness chart of a FullnessStore, cached by the store's data version so it is only
+    re-rendered when the readings change. Every caller gets the same PNG bytes.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.version = None
+        self.png = None
+        self._lock = threading.Lock()
+
+    def get_png(self):
+        with self._lock:
+            if self.png is None or self.version != self.store.version:
+                version = self.store.version
+                fullness_list, name_list = self.store.snapshot()
+                self.png = render_fullness_chart(name_list, fullness_list)
+                self.version = version
+            return self.png
+
+    def save(self, path=CHART_PATH):
+        # Written to a temporary file and renamed, so a reader never sees a partial PNG
+        png = self.get_png()
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(png)
+        os.replace(temp_path, path)
+        return png
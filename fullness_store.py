@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+import numpy as np
+from model_socket import parse_fullness
+
+class FullnessStore:
+    """
+    In-process store of the latest fullness snapshot, updated once per poll.
+    Keeps a fixed-size ring buffer of recent (timestamp, fullness) readings for every tank.
+    """
+    def __init__(self, capacity=1440):
+        self.capacity = capacity
+        self.version = 0
+        self.timestamp = None
+        self.name_list = []
+        self.fullness_list = []
+        self._times = {}
+        self._values = {}
+        self._next = {}
+        self._count = {}
+        self._file_mtime = None
+        self._lock = threading.Lock()
+
+    def update(self, name_list, fullness_list, timestamp=None):
+        """
+        Replaces the current snapshot and appends each reading to its tank's history.
+        Returns the new version number.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            for name, fullness in zip(name_list, fullness_list):
+                if name not in self._values:
+                    self._times[name] = np.zeros(self.capacity, dtype=np.float64)
+                    self._values[name] = np.zeros(self.capacity, dtype=np.float32)
+                    self._next[name] = 0
+                    self._count[name] = 0
+                index = self._next[name]
+                self._times[name][index] = timestamp
+                self._values[name][index] = fullness
+                self._next[name] = (index + 1) % self.capacity
+                self._count[name] = min(self._count[name] + 1, self.capacity)
+            self.name_list = list(name_list)
+            self.fullness_list = list(fullness_list)
+            self.timestamp = timestamp
+            self.version += 1
+            return self.version
+
+    def update_from_text(self, text, timestamp=None):
+        fullness_list, name_list = parse_fullness(text)
+        return self.update(name_list, fullness_list, timestamp)
+
+    def refresh_from_file(self, path='fullness.txt'):
+        """
+        Loads the file into the store only when its modification time changed,
+        for processes that do not poll the Raspberry Pi themselves.
+        """
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return self.version
+        if mtime == self._file_mtime:
+            return self.version
+        with open(path, 'r') as file:
+            text = file.read()
+        self._file_mtime = mtime
+        return self.update_from_text(text, timestamp=mtime)
+
+    def snapshot(self):
+        # Same shape as model_socket.read_fullness
+        with self._lock:
+            return list(self.fullness_list), list(self.name_list)
+
+    def history(self, name, limit=None):
+        """
+        Returns (timestamps, fullness) arrays of a tank's recent readings, oldest first.
+        """
+        with self._lock:
+            if name not in self._values:
+                return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float32)
+            count = self._count[name]
+            if limit is not None:
+                count = min(count, limit)
+            order = (self._next[name] - count + np.arange(count)) % self.capacity
+            return self._times[name][order], self._values[name][order]
+
+    def trend(self, name, limit=None):
+        """
+        Least-squares slope of a tank's recent readings in fullness units per minute,
+        or None if there are fewer than two readings.
+        """
+        timestamps, values = self.history(name, limit)
+        if len(values) < 2 or timestamps[-1] == timestamps[0]:
+            return None
+        minutes = (timestamps - timestamps[0]) / 60
+        return float(np.polyfit(minutes, values, 1)[0])
+
+
+fullness_store = FullnessStore()
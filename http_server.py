@@ -1,18 +1,21 @@
 import json
 import requests
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response, g, send_file
 import random
 import time
-import csv
-import io
-import matplotlib.pyplot as plt
-from flask import send_file, send_from_directory
-from server import TelegramBot
-from config_reader import ConfigReader
+from config_reader import ConfigReader, DEFAULT_SITE
 import os
+import threading
 import rsa
 import base64
-from model_socket import initialize_model, predict_roc, predict_useuptime, read_fullness
+from hybrid_crypto import SessionKey, KEY_ROTATED_HEADER, DECRYPT_FAILED, UNKNOWN_SESSION_KEY
+from model_socket import ModelRegistry
+from forecast_worker import ForecastWorker, snapshot_age, snapshot_to_dict
+from forecast_pool import create_forecast_pool
+from fullness_store import fullness_store
+from fullness_chart import CHART_PATH, FullnessChart
+from timeseries_store import TimeSeriesStore
+from metrics import registry, route_latency, pi_call, CONTENT_TYPE as METRICS_CONTENT_TYPE
 
 
 app = Flask(__name__)
@@ -26,29 +29,83 @@ port_num = configReader.get_param('RASPI', 'port_num')
 raspi_url = f"http://{ip}:{port_num}"
 print(raspi_url)
 public_key = None
-model_list = initialize_model()
+session_key = None
+hybrid_encryption = (configReader.get_param('RASPI', 'hybrid_encryption') or 'false').lower() == 'true'
+# Pi servers that answer a failed decryption without an error code are recognized by this text
+decrypt_error_text = (configReader.get_param('RASPI', 'decrypt_error_text') or 'decrypt').lower()
+fullness_chart = FullnessChart(fullness_store)  # Only used while the bot has not saved a chart
+# The store, the models and the forecast pool are built on first use: the pool's spawned workers
+# import this module again as __mp_main__ and must not build their own
+_state_lock = threading.Lock()
+_timeseries_store = None
+_forecast_worker = None
+
+def get_timeseries_store():
+    global _timeseries_store
+    with _state_lock:
+        if _timeseries_store is None:
+            _timeseries_store = TimeSeriesStore('timeseries')
+        return _timeseries_store
+
+def get_forecast_worker():
+    global _forecast_worker
+    with _state_lock:
+        if _forecast_worker is None:
+            storage_tanks = configReader.get_storagetank_info(DEFAULT_SITE)
+            forecast_pool = create_forecast_pool(configReader, {DEFAULT_SITE: storage_tanks})
+            _forecast_worker = ForecastWorker(ModelRegistry(storage_tanks), fullness_store, 'fullness.txt',
+                                              forecast_pool=forecast_pool, site_id=DEFAULT_SITE)
+        return _forecast_worker
 
 def get_public_key():
-    global public_key
+    global public_key, session_key
     # Request the public key from the server
     print("\n-----------Get Public Key Session----------")
-    response = requests.get(f"{raspi_url}/get_public_key")
+    with pi_call("/get_public_key") as call:
+        response = requests.get(f"{raspi_url}/get_public_key")
+        call.status = response.status_code
     public_key_pem = response.json()['public_key']
     print("Public key retrieved!")
     print("Public Key:")
     
-    # Load the public key
+    # Load the public key, any session key wrapped with the old one is no longer usable
     public_key = rsa.PublicKey.load_pkcs1(public_key_pem.encode())
+    session_key = None
     print(public_key)
     print("-------------------------------------------\n")
 
 
+def error_code(response):
+    # The "code" and "error" fields of a 400 answer, see the error contract in hybrid_crypto
+    if response.status_code != 400:
+        return None, ''
+    try:
+        body = response.json()
+    except ValueError:
+        return None, ''
+    if not isinstance(body, dict):
+        return None, ''
+    return body.get('code'), str(body.get('error', ''))
+
+
+def key_refresh_needed(response):
+    # The server signals a rotated key with a header, or rejects a message it could not decrypt
+    if response.headers.get(KEY_ROTATED_HEADER):
+        return True
+    code, error = error_code(response)
+    if code is not None:
+        return code == DECRYPT_FAILED
+    return response.status_code == 400 and decrypt_error_text in error.lower()
+
+
 def encrypt_json(data):
     global public_key
     print("+++++++++++++++Encryption Session+++++++++++++++")
     print("Original Data:")
     print(data)
-    get_public_key()
+    # The public key is cached and only fetched again when the server asks for it
+    if public_key is None:
+        get_public_key()
 
     # Encode the JSON credentials in base64
     json_credentials = json.dumps(data)
@@ -63,38 +120,78 @@ def encrypt_json(data):
     return encrypted_message_base64
 
 
+def encrypt_payload(data):
+    """
+    Builds the JSON body of an encrypted request. In hybrid mode the data is encrypted with a reused
+    session key, sent with the key's ID and, until the Pi has accepted it, the RSA-wrapped key;
+    otherwise raw RSA is used.
+    """
+    global session_key
+    if not hybrid_encryption:
+        return {"encrypted_message": encrypt_json(data)}
+    if public_key is None:
+        get_public_key()
+    if session_key is None:
+        session_key = SessionKey(public_key)
+    return session_key.payload(data)
+
+
+def post_to_pi(path, payload):
+    with pi_call(path) as call:
+        response = requests.post(f"{raspi_url}{path}", json=payload)
+        call.status = response.status_code
+    return response
+
+
+def post_encrypted(path, data):
+    response = post_to_pi(path, encrypt_payload(data))
+    if key_refresh_needed(response):
+        # Retry once with the server's current key
+        get_public_key()
+        response = post_to_pi(path, encrypt_payload(data))
+    elif session_key is not None and error_code(response)[0] == UNKNOWN_SESSION_KEY:
+        # The Pi dropped the session key (e.g. it restarted), send the wrapped key again
+        session_key.acknowledged = False
+        response = post_to_pi(path, encrypt_payload(data))
+        if key_refresh_needed(response):
+            # It also came back with a new key pair, the resent key was wrapped with the old one
+            get_public_key()
+            response = post_to_pi(path, encrypt_payload(data))
+    if hybrid_encryption and session_key is not None and response.status_code != 400:
+        # The Pi decrypted the message, so it has the session key cached
+        session_key.acknowledged = True
+    return response
+
+
 def save_user(data):
     try:
-        response = requests.post(f"{raspi_url}/register", json={"encrypted_message": encrypt_json(data)})
+        response = post_encrypted("/register", data)
         return response
     except Exception as e:
         print(f"Error connecting to the database: {e}")
-        get_public_key()
         return None
 
 def authenticate_user(data):
     try:
-        response = requests.post(f"{raspi_url}/login", json={"encrypted_message": encrypt_json(data)})
+        response = post_encrypted("/login", data)
         return response
     except Exception as e:
         print(f"Error connecting to the database: {e}")
-        get_public_key()
         return None
 
 def add_chat_id(data):
     try:
-        response = requests.post(f"{raspi_url}/add_chat_id", json={"encrypted_message": encrypt_json(data)})
+        response = post_encrypted("/add_chat_id", data)
         return response
     except Exception as e:
         print(f"Error connecting to the database: {e}")
-        get_public_key()
         return None
 
 def get_chat_id(username, password):
     try:
         # Send both username and password to the database server for verification
         data = {"username": username, "password": password}
-        response = requests.post(f"{raspi_url}/get_chat_id", json={"encrypted_message": encrypt_json(data)})
+        response = post_encrypted("/get_chat_id", data)
 
         if response.status_code == 200:
             chat_id = response.json().get('chat_id')
@@ -105,9 +202,28 @@ def get_chat_id(username, password):
             return None
     except Exception as e:
         print(f"Error connecting to the database: {e}")
-        get_public_key()
         return None
 
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_latency(response):
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        route_latency.observe(time.perf_counter() - started, route=route, method=request.method,
+                              status=response.status_code)
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(registry.render(), mimetype=METRICS_CONTENT_TYPE)
+
+
 @app.route('/')
 def home():
     # Check if the user is logged in
@@ -192,54 +308,76 @@ def redirect_page():
 #         return redirect(url_for('login'))
 
 
-# Function to fetch data from a CSV file
-def fetch_data():
-    data = []
-    with open('data.csv', 'r') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            data.append(row)
-    return data
+# Function to fetch a tank's readings from the time-series store, only the segments in range are read
+def fetch_data(tank, start=None, end=None):
+    timestamps, fullness = get_timeseries_store().query(tank, start, end)
+    return [{"timestamp": float(timestamp), "fullness": float(value)} for timestamp, value in zip(timestamps, fullness)]
 
 
 # Route to render the main page
 @app.route('/main')
 def main():
     if 'username' in session:
-        fullness_list, _ = read_fullness()
-        roc_list = []
-        depletion_list = []
-        for i in range(len(fullness_list)):
-            roc_list.append(round(predict_roc(model_list[i]), 2))
-            depletion_list.append(predict_useuptime(fullness_list[i], model_list[i]))
-            
-        # Placeholder data for ROC and depletion times for each tank
-        # roc_sugar = 5  # Example: Rate of consumption in kg/day
-        # depletion_sugar = "2024-11-30"  # Example: Expected depletion date
-        # roc_grains = 3  # Example for Tank 2
-        # depletion_grains = "2024-12-15"
-        # roc_flour = 4  # Example for Tank 3
-        # depletion_flour = "2024-12-20"
-        # roc_legumes = 2  # Example for Tank 4
-        # depletion_legumes = "2025-01-05"
-        return render_template('main.html', 
-                               roc_grains=roc_list[0], depletion_grains=depletion_list[0],
-                               roc_sugar=roc_list[1], depletion_sugar=depletion_list[1],
-                               roc_flour=roc_list[2], depletion_flour=depletion_list[2], 
-                               roc_legumes=roc_list[3], depletion_legumes=depletion_list[3])
+        # The forecast is computed by the background worker, the request only renders its snapshot
+        forecast_worker = get_forecast_worker()
+        forecast_worker.start()
+        snapshot = forecast_worker.get_snapshot()
+        tanks = snapshot_to_dict(snapshot)["tanks"]
+        for tank in tanks:
+            tank["roc"] = round(tank["roc"], 2)
+        return render_template('main.html', tanks=tanks, snapshot_age=snapshot_age(snapshot),
+                               snapshot_version=snapshot.version)
     else:
         return redirect(url_for('login'))
 
 
 
+# Compact JSON of every configured tank, taken from the latest forecast snapshot
+@app.route('/api/tanks')
+def api_tanks():
+    if 'username' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+    forecast_worker = get_forecast_worker()
+    forecast_worker.start()
+    forecast_worker.get_snapshot()
+    return Response(forecast_worker.snapshot_json, mimetype='application/json')
+
+
+# Server-Sent Events stream, every published snapshot is sent to all connected dashboards
+@app.route('/api/tanks/stream')
+def api_tanks_stream():
+    if 'username' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+    forecast_worker = get_forecast_worker()
+    forecast_worker.start()
+    forecast_worker.get_snapshot()
+
+    def stream():
+        sequence = None
+        while True:
+            sequence, snapshot_json = forecast_worker.wait_for_update(sequence)
+            if snapshot_json is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"data: {snapshot_json}\n\n"
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 # Route to generate and return the plot image
 @app.route('/plot_data')
 def plot_data():
-    # Path to the directory where 'dustbin_fullness.png' is located
-    image_directory = app.root_path  # Assuming the image is in the 'static' folder
-    image_filename = 'storagetank_fullness.png'
-    # Return the image from the static folder
-    return send_from_directory(image_directory, image_filename, mimetype='image/png')
+    # The bot saves the chart after every new reading, those bytes are served with an ETag and
+    # Last-Modified from the file; the chart is only rendered here when the bot has not saved one
+    try:
+        return send_file(os.path.abspath(CHART_PATH), mimetype='image/png', conditional=True, max_age=0)
+    except FileNotFoundError:
+        pass
+    fullness_store.refresh_from_file('fullness.txt')
+    response = Response(fullness_chart.get_png(), mimetype='image/png')
+    response.set_etag(f"fullness-{fullness_chart.version}-{fullness_store.timestamp}")
+    return response.make_conditional(request)
 
 
 @app.route('/signup', methods=['GET', 'POST'])
@@ -336,4 +474,10 @@ def verify_otp(input_otp):
     return input_otp == session.get('otp')
     
 if __name__ == '__main__':
+    # Warm the models in the background so the server starts accepting requests right away
+    forecast_worker = get_forecast_worker()
+    threading.Thread(target=forecast_worker.model_registry.load_all, daemon=True).start()
+    if forecast_worker.forecast_pool is not None:
+        threading.Thread(target=forecast_worker.forecast_pool.warm_up, daemon=True).start()
+    forecast_worker.start()
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,105 @@
+import os
+import hmac
+import json
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+import pyaes
+import rsa
+
+# Error contract of the Pi's encrypted endpoints. A message the Pi cannot use is answered with
+# 400 and a JSON body {"error": <text>, "code": <one of the codes below>}; a rotated key pair is
+# announced with the KEY_ROTATED_HEADER header on any response.
+KEY_ROTATED_HEADER = "X-Key-Rotated"
+DECRYPT_FAILED = "decrypt_failed"  # Not decryptable with the current key pair: fetch the public key again
+UNKNOWN_SESSION_KEY = "unknown_session_key"  # Session key ID not (or no longer) cached: send the wrapped key again
+
+
+class UnknownSessionKey(ValueError):
+    pass
+
+
+class SessionKey:
+    """
+    Symmetric session key for hybrid encryption. The key is wrapped once with the server's RSA
+    public key and sent with its random ID until the server has accepted a message. After that only
+    the ID is sent and the server uses the key it unwrapped the first time, so neither side does
+    any RSA work per request, only AES-CTR and an HMAC-SHA256 tag. The saving is the Pi's RSA
+    private-key operation: on the client, pure-Python AES costs more than one RSA public-key
+    encryption of a short message.
+
+    Wire format of an encrypted message: base64(nonce[16] + ciphertext + tag[32]).
+    The wrapped key is base64(rsa(aes_key[32] + mac_key[32])).
+    """
+    def __init__(self, public_key):
+        self.aes_key = os.urandom(32)
+        self.mac_key = os.urandom(32)
+        self.key_id = os.urandom(16).hex()
+        self.wrapped_key = base64.b64encode(rsa.encrypt(self.aes_key + self.mac_key, public_key)).decode()
+        self.acknowledged = False  # Set once the server has decrypted a message, i.e. cached the key
+
+    def encrypt(self, plaintext):
+        nonce = os.urandom(16)
+        counter = pyaes.Counter(initial_value=int.from_bytes(nonce, 'big'))
+        ciphertext = pyaes.AESModeOfOperationCTR(self.aes_key, counter=counter).encrypt(plaintext)
+        tag = hmac.new(self.mac_key, nonce + ciphertext, hashlib.sha256).digest()
+        return base64.b64encode(nonce + ciphertext + tag).decode()
+
+    def encrypt_json(self, data):
+        return self.encrypt(json.dumps(data).encode())
+
+    def payload(self, data):
+        # JSON body of a request, the wrapped key is only included until the server knows the key
+        body = {"key_id": self.key_id, "encrypted_message": self.encrypt_json(data)}
+        if not self.acknowledged:
+            body["encrypted_key"] = self.wrapped_key
+        return body
+
+
+def decrypt_message(aes_key, mac_key, message):
+    # Reverse of SessionKey.encrypt, for the receiving side
+    raw = base64.b64decode(message)
+    nonce, ciphertext, tag = raw[:16], raw[16:-32], raw[-32:]
+    expected = hmac.new(mac_key, nonce + ciphertext, hashlib.sha256).digest()
+    if not hmac.compare_digest(tag, expected):
+        raise ValueError("Message authentication failed")
+    counter = pyaes.Counter(initial_value=int.from_bytes(nonce, 'big'))
+    return pyaes.AESModeOfOperationCTR(aes_key, counter=counter).decrypt(ciphertext)
+
+
+class SessionKeyCache:
+    """
+    Receiving side of hybrid encryption. Each session key is unwrapped with the private key once and
+    kept by its ID (least recently used keys are dropped beyond `maxsize`), so later messages under
+    the same key cost no RSA operation.
+    """
+    def __init__(self, private_key, maxsize=1024):
+        self.private_key = private_key
+        self.maxsize = maxsize
+        self.unwrapped = 0  # RSA decryptions done, one per new session key
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def decrypt(self, body):
+        """
+        Returns the plaintext of a hybrid request body. Raises UnknownSessionKey when the body only
+        names a key that is not cached, rsa.DecryptionError or ValueError when it cannot be decrypted.
+        """
+        key_id = body.get("key_id")
+        with self._lock:
+            keys = self._keys.get(key_id) if key_id is not None else None
+            if keys is not None:
+                self._keys.move_to_end(key_id)
+        if keys is None:
+            if "encrypted_key" not in body:
+                raise UnknownSessionKey(key_id)
+            session_key = rsa.decrypt(base64.b64decode(body["encrypted_key"]), self.private_key)
+            keys = (session_key[:32], session_key[32:])
+            with self._lock:
+                self.unwrapped += 1
+                if key_id is not None:
+                    self._keys[key_id] = keys
+                    while len(self._keys) > self.maxsize:
+                        self._keys.popitem(last=False)
+        return decrypt_message(keys[0], keys[1], body["encrypted_message"])
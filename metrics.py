@@ -0,0 +1,170 @@
+"""
+Minimal Prometheus-style metrics: counters and latency histograms with labels, rendered in the
+Prometheus text exposition format. Shared by the bot and the dashboard processes.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in pairs]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(name, "") for name in self.label_names), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [0] * (len(self.buckets) + 2)
+                self._series[key] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', bound))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', '+Inf'))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, label_names=()):
+        return self._metrics.get(name) or self.register(Counter(name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._metrics.get(name) or self.register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Hot-path metrics used across the project
+handler_latency = registry.histogram("telegram_handler_seconds", "Latency of Telegram handlers", ["handler"])
+dispatch_latency = registry.histogram("telegram_dispatch_seconds", "Time to pick the handler of an incoming message",
+                                      buckets=(1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3))
+route_latency = registry.histogram("http_route_seconds", "Latency of dashboard routes", ["route", "method", "status"])
+model_predict_calls = registry.counter("model_predict_calls_total", "Calls to model.predict", ["model"])
+pi_requests = registry.counter("pi_requests_total", "HTTP requests to the Raspberry Pi", ["path", "status"])
+pi_latency = registry.histogram("pi_request_seconds", "Latency of HTTP requests to the Raspberry Pi", ["path"])
+pi_shared_lookups = registry.counter("pi_shared_lookups_total", "Shared GETs to the Raspberry Pi by cache result",
+                                     ["path", "result"])
+alerts_sent = registry.counter("alerts_sent_total", "Alert messages sent to Telegram chats", ["result"])
+poll_cycle_latency = registry.histogram("poll_cycle_seconds", "Duration of one polling cycle")
+site_poll_latency = registry.histogram("site_poll_seconds", "Duration of one poll of a site", ["site"])
+site_poll_errors = registry.counter("site_poll_errors_total", "Failed requests while polling a site", ["site"])
+cycle_overruns = registry.counter("poll_cycle_overruns_total", "Polling cycles that took longer than the interval")
+
+
+class PiCall:
+    status = "error"
+
+
+@contextmanager
+def pi_call(path):
+    """
+    Times one request to the Raspberry Pi. Set `.status` on the yielded object once the response
+    arrives, requests that raise are counted with status "error".
+    """
+    call = PiCall()
+    started = time.perf_counter()
+    try:
+        yield call
+    finally:
+        pi_latency.observe(time.perf_counter() - started, path=path)
+        pi_requests.inc(path=path, status=call.status)
+
+
+def start_metrics_server(port, host='0.0.0.0'):
+    """
+    Serves /metrics from a daemon thread, for processes without a web server of their own.
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -1,12 +1,21 @@
 import os
-import joblib
 import numpy as np
 from datetime import datetime
 import warnings
+import weakref
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from metrics import model_predict_calls
 
 # Suppress specific warning
 warnings.filterwarnings("ignore", category=UserWarning)
 
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+NO_MODEL = "No model"  # Depletion text of a tank in fullness.txt without a configured model
+
 def day_to_index(day):
     # Dictionary to map days to index (Sunday=0, Monday=1, ..., Saturday=6)
     days_of_week = {
@@ -22,6 +31,7 @@ def day_to_index(day):
     return days_of_week.get(day)
 
 def initialize_model():
+    import joblib
     # Get the current working directory
     current_dir = os.getcwd()
     model_dir = os.path.join(current_dir, "model")
@@ -31,22 +41,323 @@ def initialize_model():
         model_list.append(loaded_model)
     return model_list
     
-def predict_roc(model):
-    # Get the current date and time
-    now = datetime.now()
-    # Extract hour and minute
-    current_hour = now.hour
-    current_minute = now.minute
-    # Get the day of the week (Monday is 0 and Sunday is 6)
-    day_of_week = now.strftime("%A")  # Returns the full name of the day (e.g., 'Thursday')
-    day = day_to_index(day_of_week)
-    # Use the loaded model to make predictions
-    new_input = np.array([[current_hour*60+current_minute, day]])  # Example input for 12 PM on Thursday
-    predicted_rate_of_change = model.predict(new_input)
-    print(f"Predicted rate of change: {predicted_rate_of_change[0]:.4f} units/minute")
-    return predicted_rate_of_change[0] 
-    
-    
+class OnlineConsumptionModel:
+    """
+    Per-tank consumption model learned from live readings. Keeps an exponentially weighted rate of
+    change for every bucket of the week, updated in O(1) per reading. Exposes the same predict(X)
+    interface as the pickled models (X columns are minute_of_day and weekday), so it plugs into the
+    rate table and depletion forecasts unchanged. `version` increases with every update.
+    """
+    def __init__(self, bucket_minutes=15, alpha=0.1, max_gap_minutes=60, refill_jump=5.0):
+        self.bucket_minutes = bucket_minutes
+        self.alpha = alpha
+        self.max_gap_minutes = max_gap_minutes
+        self.refill_jump = refill_jump
+        self.rates = np.zeros(MINUTES_PER_WEEK // bucket_minutes)
+        self.seen = np.zeros(len(self.rates), dtype=bool)
+        self.global_rate = 0.0
+        self.last_timestamp = None
+        self.last_fullness = None
+        self.version = 0
+
+    def observe(self, timestamp, fullness):
+        """
+        Updates the model with one reading (unix timestamp, fullness). Returns True if a rate was learned.
+        """
+        learned = False
+        if self.last_timestamp is not None:
+            minutes = (timestamp - self.last_timestamp) / 60
+            change = fullness - self.last_fullness
+            # Readings after a long gap or a refill say nothing about consumption
+            if 0 < minutes <= self.max_gap_minutes and change < self.refill_jump:
+                rate = change / minutes
+                bucket = minute_of_week(datetime.fromtimestamp(self.last_timestamp)) // self.bucket_minutes
+                if self.seen[bucket]:
+                    self.rates[bucket] += self.alpha * (rate - self.rates[bucket])
+                else:
+                    self.rates[bucket] = rate
+                    self.seen[bucket] = True
+                self.global_rate += self.alpha * (rate - self.global_rate)
+                self.version += 1
+                learned = True
+        if self.last_timestamp is None or timestamp >= self.last_timestamp:
+            self.last_timestamp = timestamp
+            self.last_fullness = fullness
+        return learned
+
+    def predict(self, X):
+        X = np.asarray(X)
+        index = (X[:, 1].astype(int) * MINUTES_PER_DAY + X[:, 0].astype(int)) // self.bucket_minutes
+        # Buckets without readings yet fall back to the overall rate
+        rates = np.where(self.seen, self.rates, self.global_rate)
+        return rates[index % len(rates)]
+
+    def save(self, path):
+        temp_path = path + ".tmp.npz"
+        np.savez(temp_path, rates=self.rates, seen=self.seen,
+                 state=np.array([self.global_rate, self.last_timestamp if self.last_timestamp is not None else np.nan,
+                                 self.last_fullness if self.last_fullness is not None else np.nan, self.version]),
+                 params=np.array([self.bucket_minutes, self.alpha, self.max_gap_minutes, self.refill_jump]))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            bucket_minutes, alpha, max_gap_minutes, refill_jump = data["params"]
+            model = cls(int(bucket_minutes), float(alpha), float(max_gap_minutes), float(refill_jump))
+            model.rates = data["rates"].copy()
+            model.seen = data["seen"].copy()
+            global_rate, last_timestamp, last_fullness, version = data["state"]
+        model.global_rate = float(global_rate)
+        model.last_timestamp = None if np.isnan(last_timestamp) else float(last_timestamp)
+        model.last_fullness = None if np.isnan(last_fullness) else float(last_fullness)
+        model.version = int(version)
+        return model
+
+
+class ModelRegistry:
+    """
+    Maps storage tank tags to their model files. Models are loaded on first use (or in parallel with
+    load_all) and reloaded when the file's modification time changes, so retrained models are picked
+    up without restarting the process.
+
+    Tanks with `backend = online` use an OnlineConsumptionModel instead, which learns from the readings
+    passed to observe(). Its state is loaded from the tank's online_model file when present and saved
+    back after each update if persist_online is set.
+    """
+    def __init__(self, storage_tanks, model_dir=None, check_interval=30, persist_online=False):
+        if model_dir is None:
+            model_dir = os.path.join(os.getcwd(), "model")
+        self.model_dir = model_dir
+        self.check_interval = check_interval
+        self.persist_online = persist_online
+        self.paths = {tank["tag"]: os.path.join(model_dir, tank["model"]) for tank in storage_tanks}
+        self.backends = {tank["tag"]: tank.get("backend", "pickle") for tank in storage_tanks}
+        self.online_paths = {tank["tag"]: os.path.join(model_dir, tank["online_model"])
+                             for tank in storage_tanks if "online_model" in tank}
+        self._models = {}  # tag -> (model, mtime, time of last mtime check)
+        self._online_models = {}  # tag -> OnlineConsumptionModel
+        self._unconfigured = set()  # Tags already warned about in models_for
+        self._lock = threading.Lock()
+
+    def _get_online(self, tag):
+        model = self._online_models.get(tag)
+        if model is None:
+            with self._lock:
+                model = self._online_models.get(tag)
+                if model is None:
+                    path = self.online_paths.get(tag)
+                    if path is not None and os.path.exists(path):
+                        model = OnlineConsumptionModel.load(path)
+                        print(f"Loaded online model for {tag} from {path}")
+                    else:
+                        model = OnlineConsumptionModel()
+                    self._online_models[tag] = model
+        return model
+
+    def observe(self, name_list, fullness_list, timestamp):
+        # Feeds a reading of every tank to the online models, pickled models ignore it
+        for name, fullness in zip(name_list, fullness_list):
+            if self.backends.get(name) != "online":
+                continue
+            model = self._get_online(name)
+            if model.observe(timestamp, fullness) and self.persist_online and name in self.online_paths:
+                model.save(self.online_paths[name])
+
+    def _load(self, tag):
+        path = self.paths[tag]
+        import joblib  # Imported on first load to keep process start-up light
+        mtime = os.path.getmtime(path)
+        # Memory-map the numpy arrays inside the pickle where joblib allows it
+        model = joblib.load(path, mmap_mode='r')
+        print(f"Loaded model for {tag} from {path}")
+        return model, mtime
+
+    def get(self, tag):
+        if tag not in self.paths:
+            raise KeyError(f"No model configured for storage tank {tag}")
+        if self.backends[tag] == "online":
+            return self._get_online(tag)
+        entry = self._models.get(tag)
+        now = time.monotonic()
+        if entry is not None:
+            model, mtime, checked = entry
+            if now - checked < self.check_interval:
+                return model
+            try:
+                if os.path.getmtime(self.paths[tag]) == mtime:
+                    self._models[tag] = (model, mtime, now)
+                    return model
+            except OSError:
+                # Keep serving the loaded model while the file is being replaced
+                return model
+        with self._lock:
+            model, mtime = self._load(tag)
+            self._models[tag] = (model, mtime, now)
+        return model
+
+    def load_all(self, max_workers=4):
+        # Load every configured model in parallel, e.g. to warm up before serving
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self.get, self.paths))
+
+    def models_for(self, name_list):
+        # Models in the same order as the tank names read from fullness.txt, None for a tank without
+        # a STORAGE_TANK section so one unknown name does not stop the forecast of the others
+        models = []
+        for name in name_list:
+            if name not in self.paths:
+                if name not in self._unconfigured:
+                    self._unconfigured.add(name)
+                    print(f"Warning: no model configured for storage tank {name}, it is not forecast")
+                models.append(None)
+            else:
+                models.append(self.get(name))
+        return models
+
+
+def minute_of_week(now=None):
+    # Position of `now` in the week, using the (minute_of_day, weekday) layout the models were trained on
+    if now is None:
+        now = datetime.now()
+    weekday = day_to_index(now.strftime("%A"))
+    return weekday * MINUTES_PER_DAY + now.hour * 60 + now.minute
+
+
+class RateTable:
+    """
+    Predicted rate of change for every minute of the week, evaluated with a single model.predict call.
+    Depletion queries are answered from the cumulative consumption with a binary search instead of
+    stepping through the week one minute at a time.
+    """
+    def __init__(self, model):
+        self.version = model_version(model)
+        minute_of_day = np.tile(np.arange(MINUTES_PER_DAY), 7)
+        weekday = np.repeat(np.arange(7), MINUTES_PER_DAY)
+        self.rates = model.predict(np.column_stack([minute_of_day, weekday]))
+        model_predict_calls.inc(model=type(model).__name__)
+        # Only negative rates consume stock, same as the original per-minute loop
+        consumption = np.where(self.rates < 0, -self.rates, 0.0)
+        self.week_total = consumption.sum()
+        # Two weeks back to back so a query starting at any minute can read a full week without wrapping
+        self.cumulative = np.cumsum(np.concatenate([consumption, consumption]))
+
+    def rate_at(self, index):
+        return self.rates[index % MINUTES_PER_WEEK]
+
+    def minutes_until_depleted(self, current_inventory_level, start):
+        """
+        Returns the number of minutes until the inventory reaches zero when starting at minute-of-week
+        `start`, or None if the model never predicts any consumption.
+        """
+        if current_inventory_level <= 0:
+            return 0
+        if self.week_total <= 0:
+            return None
+        start %= MINUTES_PER_WEEK
+        base = self.cumulative[start - 1] if start > 0 else 0.0
+        # Skip whole weeks first, keeping the last one for the search so a partial week is never empty
+        weeks = int(current_inventory_level // self.week_total)
+        remaining = current_inventory_level - weeks * self.week_total
+        if remaining <= 0:
+            weeks -= 1
+            remaining += self.week_total
+        window = self.cumulative[start:start + MINUTES_PER_WEEK] - base
+        offset = int(np.searchsorted(window, remaining, side='left'))
+        return weeks * MINUTES_PER_WEEK + offset + 1
+
+
+_rate_tables = weakref.WeakKeyDictionary()
+
+def model_version(model):
+    # Online models change in place and count their updates, pickled models never change
+    return getattr(model, "version", 0)
+
+def get_rate_table(model):
+    # Built once per loaded model (and model version) and reused by every caller
+    table = _rate_tables.get(model)
+    if table is None or table.version != model_version(model):
+        table = RateTable(model)
+        _rate_tables[model] = table
+    return table
+
+class ForecastCache:
+    """
+    Bounded LRU cache with a time-to-live for forecast results, keyed by
+    (tank, fullness, minute-of-week). Shared by predict_roc, predict_useuptime and forecast_all.
+
+    By default the key holds the exact fullness and cached results equal the original per-minute
+    loop. With `fullness_step` set, levels are rounded to that step in the key only, so a hit may
+    return the depletion time of a level up to half a step away (trading exactness for hit rate).
+    """
+    def __init__(self, maxsize=4096, ttl=60, fullness_step=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.fullness_step = fullness_step
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def quantize(self, fullness):
+        if fullness is None or self.fullness_step is None:
+            return fullness
+        return round(round(fullness / self.fullness_step) * self.fullness_step, 6)
+
+    def key(self, tank, fullness, start):
+        return (tank, self.quantize(fullness), start % MINUTES_PER_WEEK)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+forecast_cache = ForecastCache()
+
+def predict_roc(model, now=None, tank=None):
+    start = minute_of_week(now)
+    key = forecast_cache.key((tank if tank is not None else model, model_version(model)), None, start)
+    predicted_rate_of_change = forecast_cache.get(key)
+    if predicted_rate_of_change is None:
+        predicted_rate_of_change = get_rate_table(model).rate_at(start)
+        forecast_cache.put(key, predicted_rate_of_change)
+    print(f"Predicted rate of change: {predicted_rate_of_change:.4f} units/minute")
+    return predicted_rate_of_change
+
+
 def convert_minutes(total_minutes):
     days = total_minutes // (24 * 60)  # Calculate days
     remaining_minutes = total_minutes % (24 * 60)  # Remaining minutes after days are calculated
@@ -54,48 +365,109 @@ def convert_minutes(total_minutes):
     minutes = remaining_minutes % 60  # Remaining minutes after hours are calculated
     return days, hours, minutes
 
-# Run a while loop until the inventory is depleted
-def predict_useuptime(current_inventory_level, model, convertstr=True):
-    time_elapsed = 0
-    now = datetime.now()
-    minute_of_day = now.minute + now.hour * 60
-    weekday = day_to_index(now.strftime("%A"))
-    while current_inventory_level > 0:
-        # Predict the rate of change for the current time and weekday
-        new_input = np.array([[minute_of_day, weekday]])
-        predicted_rate_of_change = model.predict(new_input)[0]
-        # If the rate of change is negative, decrease the inventory
-        if predicted_rate_of_change < 0:
-            current_inventory_level += predicted_rate_of_change
-        time_elapsed += 1  # Increment time by one minute
-        minute_of_day = (minute_of_day + 1) % 1440  # Update time within the day
-        # Update weekday if it is the start of a new day
-        if minute_of_day == 0:
-            weekday = (weekday + 1) % 7
-        # Check if inventory has reached zero or below
-        if current_inventory_level <= 0:
-            # print(f"Inventory depleted after {time_elapsed} minutes.")
-            break
+def format_minutes(total_minutes):
+    if total_minutes is None:
+        return "Not depleting"
+    days, hours, minutes = convert_minutes(total_minutes)
+    return f"{days} days, {hours} hours, {minutes} minutes"
+
+# Minutes until the inventory is depleted, looked up from the model's weekly rate table
+def predict_useuptime(current_inventory_level, model, convertstr=True, now=None, tank=None):
+    start = minute_of_week(now)
+    key = forecast_cache.key((tank if tank is not None else model, model_version(model)), current_inventory_level, start)
+    entry = forecast_cache.get(key)
+    if entry is None:
+        table = get_rate_table(model)
+        entry = (table.rate_at(start), table.minutes_until_depleted(current_inventory_level, start))
+        forecast_cache.put(key, entry)
+    time_elapsed = entry[1]
     if convertstr:
-        days, hours, minutes = convert_minutes(time_elapsed)
-        str_return = f"{days} days, {hours} hours, {minutes} minutes"
-        return str_return
+        return format_minutes(time_elapsed)
     else:
         return time_elapsed
 
+def _forecast_batch(levels, tables, start):
+    # Tanks sharing a model share a rate table: one binary search per table for all of its tanks,
+    # against a single one-week window of that table's cumulative consumption
+    levels = np.asarray(levels, dtype=float)
+    roc_array = np.empty(len(tables))
+    minutes_array = np.zeros(len(tables), dtype=np.int64)
+    depleting = np.zeros(len(tables), dtype=bool)
+    groups = {}
+    for i, table in enumerate(tables):
+        groups.setdefault(id(table), (table, []))[1].append(i)
+    for table, indices in groups.values():
+        indices = np.array(indices)
+        roc_array[indices] = table.rates[start]
+        if table.week_total <= 0:
+            continue
+        depleting[indices] = True
+        base = table.cumulative[start - 1] if start > 0 else 0.0
+        window = table.cumulative[start:start + MINUTES_PER_WEEK] - base
+        group_levels = levels[indices]
+        weeks = np.floor_divide(group_levels, table.week_total)
+        remaining = group_levels - weeks * table.week_total
+        wrapped = remaining <= 0
+        weeks -= wrapped
+        remaining += wrapped * table.week_total
+        offset = np.searchsorted(window, remaining, side='left')
+        minutes_array[indices] = (weeks * MINUTES_PER_WEEK + offset + 1).astype(np.int64)
+
+    depletion_list = []
+    for level, minutes, is_depleting in zip(levels, minutes_array, depleting):
+        if level <= 0:
+            depletion_list.append(0)
+        elif not is_depleting:
+            depletion_list.append(None)
+        else:
+            depletion_list.append(int(minutes))
+    return roc_array.tolist(), depletion_list
+
+def forecast_all(fullness_list, model_list, now=None, tank_list=None):
+    """
+    Forecasts every tank in one pass. Tanks found in the forecast cache are served from it, the rest
+    are grouped by rate table and each group's depletion minutes are found with one binary search
+    over the table's cumulative consumption. Returns the rate of change, the minutes until depletion
+    (None when a tank never depletes) and the formatted depletion strings, one entry per tank.
+    Tanks whose model is None get a rate of 0, no depletion time and NO_MODEL as their string.
+    """
+    if len(fullness_list) == 0:
+        return [], [], []
+    start = minute_of_week(now)
+    if tank_list is None:
+        tank_list = model_list
+    keys = [None if model is None else forecast_cache.key((tank, model_version(model)), fullness, start)
+            for tank, model, fullness in zip(tank_list, model_list, fullness_list)]
+    entries = [(0.0, None) if key is None else forecast_cache.get(key) for key in keys]
+    missing = [i for i, entry in enumerate(entries) if entry is None]
+    if missing:
+        roc_list, depletion_list = _forecast_batch([fullness_list[i] for i in missing],
+                                                   [get_rate_table(model_list[i]) for i in missing], start)
+        for i, roc, depletion in zip(missing, roc_list, depletion_list):
+            entries[i] = (roc, depletion)
+            forecast_cache.put(keys[i], entries[i])
+    roc_list = [entry[0] for entry in entries]
+    depletion_list = [entry[1] for entry in entries]
+    depletion_str_list = [NO_MODEL if key is None else format_minutes(minutes)
+                          for key, minutes in zip(keys, depletion_list)]
+    return roc_list, depletion_list, depletion_str_list
+
+def parse_fullness(text):
+    fullness_list, name_list = [], []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        name, fullness = line.split()
+        # Convert fullness to a float
+        fullness = float(fullness)
+        fullness_list.append(fullness)
+        name_list.append(name)
+    return fullness_list, name_list
+
 def read_fullness():
     with open ('fullness.txt', 'r') as file:
-        fullness_list, name_list = [], []
-        for line in file:
-            line = line.strip()
-            name, fullness = line.split()
-            # Convert fullness to a float
-            fullness = float(fullness)
-            # Print the results (or do something with them)
-            # print(f"Item: {name}, Fullness: {fullness}")
-            fullness_list.append(fullness)
-            name_list.append(name)
-    return fullness_list, name_list
+        return parse_fullness(file.read())
 
 if __name__ == "__main__":
     # model_list = initialize_model()
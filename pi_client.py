@@ -0,0 +1,93 @@
+import asyncio
+import json
+import time
+import aiohttp
+from metrics import pi_call, pi_shared_lookups
+
+class PiResponse:
+    """
+    Status, headers and body of a finished request, read before the connection goes back to the pool.
+    """
+    def __init__(self, status, headers, content):
+        self.status = status
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class PiClient:
+    """
+    Shared async HTTP client for the Raspberry Pi Flask server. One pooled aiohttp session with
+    keep-alive, a timeout on every request and a cap on the number of requests in flight, so many
+    users can log in or query the Pi at the same time without blocking the event loop.
+    """
+    def __init__(self, base_url, timeout=10, max_concurrency=20, keepalive_timeout=60):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.keepalive_timeout = keepalive_timeout
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = None
+        self._shared = {}  # path -> (expires_at, PiResponse)
+        self._in_flight = {}  # path -> task fetching the path
+
+    async def session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=self.keepalive_timeout),
+            )
+        return self._session
+
+    async def request(self, method, path, **kwargs):
+        """
+        Sends one request and returns a PiResponse. Raises aiohttp.ClientError or asyncio.TimeoutError.
+        """
+        session = await self.session()
+        async with self.semaphore:
+            with pi_call(path) as call:
+                async with session.request(method, f"{self.base_url}{path}", **kwargs) as response:
+                    call.status = response.status
+                    content = await response.read()
+                    return PiResponse(response.status, response.headers, content)
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def get_shared(self, path, ttl):
+        """
+        GET for read-only endpoints many users ask for at once. Callers arriving while a request is
+        in flight wait for that request instead of sending their own, and a 200 response is reused
+        for `ttl` seconds. Errors are shared with the waiting callers but never cached.
+        """
+        cached = self._shared.get(path)
+        if cached is not None and cached[0] > time.monotonic():
+            pi_shared_lookups.inc(path=path, result="hit")
+            return cached[1]
+        task = self._in_flight.get(path)
+        if task is None:
+            pi_shared_lookups.inc(path=path, result="miss")
+            task = asyncio.ensure_future(self._fetch_shared(path, ttl))
+            self._in_flight[path] = task
+        else:
+            pi_shared_lookups.inc(path=path, result="coalesced")
+        # Shielded so one caller giving up does not cancel the request for everyone else
+        return await asyncio.shield(task)
+
+    async def _fetch_shared(self, path, ttl):
+        try:
+            response = await self.get(path)
+            if response.status == 200 and ttl > 0:
+                self._shared[path] = (time.monotonic() + ttl, response)
+            return response
+        finally:
+            del self._in_flight[path]
+
+    async def post_json(self, path, payload):
+        return await self.request('POST', path, json=payload)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
@@ -0,0 +1,119 @@
+"""
+Local stand-in for the Raspberry Pi Flask server, for running the bot, dashboard and benchmarks offline.
+
+    python pi_standin.py --port 5000 --tanks 4 --changing
+
+Accepts any credentials. Serves a fresh RSA public key, decrypts both raw RSA and hybrid
+(see hybrid_crypto) messages, caching session keys by ID, answers undecryptable messages with the
+error codes of hybrid_crypto, and serves the analysis and fullness artifacts with ETags.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import threading
+import rsa
+from flask import Flask, request, jsonify, Response
+from hybrid_crypto import SessionKeyCache, UnknownSessionKey, DECRYPT_FAILED, UNKNOWN_SESSION_KEY
+
+def fullness_text(tanks):
+    return "".join(f'"Tank{i + 1}" {random.uniform(0, 100)}\n' for i in range(tanks))
+
+def create_app(tanks=4, changing=False, key_bits=1024, occupants=None):
+    """
+    `changing` makes every fullness download return new readings, otherwise the artifacts stay the same
+    and conditional requests get 304 responses.
+    """
+    app = Flask(__name__)
+    public_key, private_key = rsa.newkeys(key_bits)
+    state = {"fullness": fullness_text(tanks), "requests": 0, "rsa_decrypts": 0}
+    lock = threading.Lock()
+    session_keys = SessionKeyCache(private_key)
+    app.config["STANDIN_STATE"] = state
+    app.config["STANDIN_SESSION_KEYS"] = session_keys
+
+    def decrypt(body):
+        if "key_id" in body or "encrypted_key" in body:
+            plaintext = session_keys.decrypt(body)
+        else:
+            state["rsa_decrypts"] += 1
+            plaintext = rsa.decrypt(base64.b64decode(body["encrypted_message"]), private_key)
+        return json.loads(plaintext)
+
+    def encrypted_endpoint(handler, success_status=200):
+        def view():
+            state["requests"] += 1
+            try:
+                data = decrypt(request.get_json())
+            except UnknownSessionKey:
+                return jsonify({"error": "Unknown session key", "code": UNKNOWN_SESSION_KEY}), 400
+            except (rsa.DecryptionError, ValueError, KeyError):
+                return jsonify({"error": "Failed to decrypt message", "code": DECRYPT_FAILED}), 400
+            return handler(data), success_status
+        view.__name__ = handler.__name__
+        return view
+
+    def artifact(content, mimetype):
+        response = Response(content, mimetype=mimetype)
+        response.set_etag(hashlib.sha256(content if isinstance(content, bytes) else content.encode()).hexdigest())
+        return response.make_conditional(request)
+
+    @app.route('/get_public_key')
+    def get_public_key():
+        state["requests"] += 1
+        return jsonify({"public_key": public_key.save_pkcs1().decode()})
+
+    def login(data):
+        return jsonify({"message": f"Welcome {data['username']}"})
+
+    def register(data):
+        return jsonify({"message": "User registered"})
+
+    def add_chat_id(data):
+        return jsonify({"message": "Chat ID added"})
+
+    def get_chat_id(data):
+        return jsonify({"chat_id": 100000 + sum(map(ord, data["username"]))})
+
+    app.add_url_rule('/login', view_func=encrypted_endpoint(login), methods=['POST'])
+    app.add_url_rule('/register', view_func=encrypted_endpoint(register, 201), methods=['POST'])
+    app.add_url_rule('/add_chat_id', view_func=encrypted_endpoint(add_chat_id), methods=['POST'])
+    app.add_url_rule('/get_chat_id', view_func=encrypted_endpoint(get_chat_id), methods=['POST'])
+
+    @app.route('/who_is_in')
+    def who_is_in():
+        state["requests"] += 1
+        return jsonify({"occupants": occupants if occupants is not None else ["Alice", "Bob"]})
+
+    @app.route('/get_fullness_txt')
+    def get_fullness_txt():
+        with lock:
+            state["requests"] += 1
+            if changing:
+                state["fullness"] = fullness_text(tanks)
+            content = state["fullness"]
+        return artifact(content, 'text/plain')
+
+    @app.route('/get_analysis')
+    def get_analysis():
+        state["requests"] += 1
+        return artifact("Fullness for Each Storage Tank\n" + state["fullness"], 'text/plain')
+
+    return app
+
+def serve_in_thread(app, port):
+    # Runs the stand-in in a daemon thread, for benchmarks and scripted checks
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Raspberry Pi server stand-in")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--tanks", type=int, default=4)
+    parser.add_argument("--changing", action="store_true")
+    args = parser.parse_args()
+    create_app(args.tanks, args.changing).run(host='127.0.0.1', port=args.port, threaded=True)
@@ -1,15 +1,23 @@
-import requests
 import asyncio
+import aiohttp
+import aiofiles
+import hashlib
 from aiogram import Bot
 from telethon import TelegramClient, events, Button
-from aiogram.types import FSInputFile # use for message handler
+from aiogram.types import BufferedInputFile # use for message handler
 from config_reader import ConfigReader
 import time
 # this is for encryption
 import rsa
 import json
 import base64
-from model_socket import initialize_model, predict_roc, predict_useuptime, read_fullness, convert_minutes
+from model_socket import forecast_all, convert_minutes
+from alert_dispatcher import AlertDispatcher
+from alert_policy import AlertPolicy
+from site_poller import SitePoller, load_sites
+from forecast_pool import create_forecast_pool
+from session_store import SessionStore
+from metrics import handler_latency, dispatch_latency, poll_cycle_latency, cycle_overruns, start_metrics_server
 
 class TelegramBot:
     """
@@ -25,29 +33,49 @@ class TelegramBot:
         self.alert_frequency = int(configReader.get_param('TELEGRAM', 'alert_frequency'))
         self.fullness_alert_threshold = float(configReader.get_param('TELEGRAM', 'fullness_alert_threshold'))
         self.depletion_alert_threshold = float(configReader.get_param('TELEGRAM', 'depletion_alert_threshold'))
+        # alert_frequency is the number of minutes before a chat is reminded about the same low tank
+        self.alert_policy = AlertPolicy(self.fullness_alert_threshold, self.depletion_alert_threshold, self.alert_frequency)
         
         self.count = 0
-        self.chat_ids = set()  # Store chat_ids of users who interact with the bot
-        self.logged_in_users = set()
-        self.pending_login = {}  # Track login state for each user
-        ip = configReader.get_param('RASPI', 'ip')
-        port_num = configReader.get_param('RASPI', 'port_num')
-        self.flask_server_url = f"http://{ip}:{port_num}"
-        print(self.flask_server_url)
+        # Session state lives in SQLite so logins survive a restart; reads come from memory
+        self.session_store = SessionStore(configReader.get_param('TELEGRAM', 'session_db') or 'bot_state.db')
+        self.chat_ids = self.session_store.set('chat_ids')  # Store chat_ids of users who interact with the bot
+        self.logged_in_users = self.session_store.set('logged_in_users')
+        self.pending_login = self.session_store.dict('pending_login')  # Track login state for each user
         self.public_key = None
+        self.public_key_lock = asyncio.Lock()  # One key fetch for all logins arriving before the key
+        self.request_timeout = float(configReader.get_param('RASPI', 'request_timeout') or 10)
+        # Seconds a /who_is_in answer is shared between users
+        self.who_is_in_ttl = float(configReader.get_param('RASPI', 'who_is_in_cache_ttl') or 0)
+        max_concurrent_requests = int(configReader.get_param('RASPI', 'max_concurrent_requests') or 20)
+        # One pooled client per site, kept alive across cycles, each with its own snapshot and model set
+        self.sites = load_sites(configReader, self.request_timeout, max_concurrent_requests,
+                                keepalive_timeout=max(60, self.interval * 4), persist_online=True)
+        self.site_poller = SitePoller(self.sites, int(configReader.get_param('TELEGRAM', 'max_parallel_sites') or 8))
+        # Logins, occupancy queries and the chart handlers use the default site
+        self.pi = self.sites[0].pi
+        self.flask_server_url = self.sites[0].base_url
+        print(self.flask_server_url)
+        self.fullness_chart = self.sites[0].fullness_chart  # Rendered locally instead of downloaded from the Pi
+        self.model_registry = self.sites[0].model_registry
+        # Process pool for large fleets, None forecasts in this process
+        self.forecast_pool = create_forecast_pool(configReader, {site.id: site.storage_tanks for site in self.sites})
         # Set up telegram bot and dustbin analyzer
         print(token)
+        metrics_port = configReader.get_param('TELEGRAM', 'metrics_port')
+        if metrics_port:
+            start_metrics_server(int(metrics_port))
         self.bot = Bot(token)
+        self.alert_dispatcher = AlertDispatcher(self.bot)
         self.client = TelegramClient('bot', api_id, api_hash).start(bot_token=token)
-        self.model_list = initialize_model()
         # Register event handlers
         self.register_handlers()
     
 
-    def get_public_key(self):
+    async def get_public_key(self):
         # Request the public key from the server
         print("\n-----------Get Public Key Session----------")
-        response = requests.get(f"{self.flask_server_url}/get_public_key")
+        response = await self.pi.get("/get_public_key")
         public_key_pem = response.json().get('public_key')
         print("Public key retrieved!")
         print("Public Key:")
@@ -58,12 +86,14 @@ class TelegramBot:
         print("-------------------------------------------\n")
 
 
-    def encrypt_json(self,data):
+    async def encrypt_json(self,data):
         print("+++++++++++++++Encryption Session+++++++++++++++")
         print("Original Data:")
         print(data)
         if self.public_key is None:
-            self.get_public_key()
+            async with self.public_key_lock:
+                if self.public_key is None:
+                    await self.get_public_key()
         else:
             print("\nPublic Key:")
             print(self.public_key)
@@ -79,9 +109,10 @@ class TelegramBot:
         print("+++++++++++++++++++++++++++++++++++++++++++++++++")
         return encrypted_message_base64
     
-    def authenticate_user(self, username, password):
+    async def authenticate_user(self, username, password):
         """
         Sends login credentials to the Flask server for authentication.
+        Returns the response, or None if the server could not be reached.
         """
         data = {
             "username": username,
@@ -89,13 +120,12 @@ class TelegramBot:
         }
         
         try:
-            response = requests.post(f"{self.flask_server_url}/login", json={"encrypted_message": self.encrypt_json(data)})
-            return response
+            return await self.pi.post_json("/login", {"encrypted_message": await self.encrypt_json(data)})
         except Exception as e:
             print(f"Error authenticating user: {e}")
             return None
 
-    def add_chat_id(self, username, chat_id):
+    async def add_chat_id(self, username, chat_id):
         """
         Sends the user's chat_id to the Flask server after successful login.
         """
@@ -104,8 +134,8 @@ class TelegramBot:
             "chat_id": chat_id
         }
         try:
-            response = requests.post(f"{self.flask_server_url}/add_chat_id", json={"encrypted_message": self.encrypt_json(data)}) # encrypt_json(data)
-            if response.status_code == 200:
+            response = await self.pi.post_json("/add_chat_id", {"encrypted_message": await self.encrypt_json(data)})
+            if response.status == 200:
                 print(f"Chat ID for {username} successfully added to the database.")
             else:
                 print(f"Failed to add chat ID for {username}.")
@@ -117,19 +147,47 @@ class TelegramBot:
     Handlers
     """
     def register_handlers(self):
-        # Registering the event handlers
-        self.client.on(events.NewMessage(pattern='Send me to real-time'))(self.realTimeGraph)
-        self.client.on(events.NewMessage(pattern='/start'))(self.main_menu)
-        self.client.on(events.NewMessage(pattern='Back!'))(self.main_menu)
-        self.client.on(events.NewMessage(pattern='who_is_in'))(self.who_is_in_handler)
-        self.client.on(events.NewMessage(pattern='Monitor who is in the factory'))(self.who_is_in_handler)
-        self.client.on(events.NewMessage(pattern='Send me a data analysis'))(self.sendDataAnalysis)
-        self.client.on(events.NewMessage(pattern='Send me a graph of current fullness!'))(self.sendGraph)
-        self.client.on(events.NewMessage(pattern='Login'))(self.login_handler)
-        self.client.on(events.NewMessage(incoming=True))(self.handle_message)  # Catch all other messages
-        self.client.on(events.NewMessage(pattern='/help'))(self.help_handler)
-        self.client.on(events.NewMessage(pattern='/logout'))(self.logout_handler)
-        self.client.on(events.NewMessage(pattern='/quit'))(self.quit_handler)
+        # Every incoming message goes through one router that picks exactly one handler by exact text
+        self.routes = {
+            '/start': self.main_menu,
+            'Back!': self.main_menu,
+            '/help': self.help_handler,
+            '/logout': self.logout_handler,
+            '/quit': self.quit_handler,
+            '/who_is_in': self.who_is_in_handler,
+            'who_is_in': self.who_is_in_handler,
+            'Monitor who is in the factory': self.who_is_in_handler,
+            'Send me to real-time': self.realTimeGraph,
+            'Send me a data analysis': self.sendDataAnalysis,
+            'Send me a graph of current fullness!': self.sendGraph,
+            'Login': self.login_handler,
+        }
+        self.client.on(events.NewMessage(incoming=True))(self.route)
+
+    @staticmethod
+    def command_key(text):
+        # "/start@my_bot payload" is looked up as "/start", button texts are looked up as they are
+        if text.startswith('/'):
+            return text.split(maxsplit=1)[0].split('@', 1)[0]
+        return text
+
+    async def route(self, event):
+        """
+        Dispatches a message to exactly one handler with a single dict lookup. Anything that is not a
+        command or button goes to handle_message, which runs the login state machine.
+        """
+        started = time.perf_counter()
+        key = self.command_key((event.message.text or '').strip())
+        handler = self.routes.get(key)
+        state = self.pending_login.get(event.sender_id)
+        if handler is not None and state is not None and state['step'] == 2 and not key.startswith('/'):
+            # A password that happens to match a button text is still a password
+            handler = None
+        if handler is None:
+            handler = self.handle_message
+        dispatch_latency.observe(time.perf_counter() - started)
+        with handler_latency.time(handler=handler.__name__):
+            await handler(event)
 
     async def quit_handler(self, event):
         """
@@ -139,6 +197,10 @@ class TelegramBot:
         await event.respond("The bot is shutting down. Goodbye!")
 
         # Stop the bot and disconnect the client
+        await asyncio.gather(*(site.close() for site in self.sites))
+        if self.forecast_pool is not None:
+            self.forecast_pool.close()
+        self.session_store.close()
         await self.client.disconnect()  # Disconnect the Telegram client
 
         # Stop the event loop after the bot responds
@@ -177,12 +239,11 @@ class TelegramBot:
     async def login_handler(self, event):
         user_id = event.sender_id
         self.pending_login[user_id] = {'step': 1, 'action': 'login'}
-        time.sleep(1)
         await event.respond("Please enter your username:")
 
     async def handle_message(self, event):
         user_id = event.sender_id
-        text = event.message.text.strip()
+        text = (event.message.text or '').strip()
         print(text)
 
         # Check if the user is in the middle of the login process
@@ -196,6 +257,7 @@ class TelegramBot:
                     return
                 state['username'] = text  # Store the entered username
                 state['step'] = 2  # Move to the next step (asking for password)
+                self.pending_login[user_id] = state
                 await event.respond("Please enter your password:")
 
             # Step 2: Get Password and handle login
@@ -205,12 +267,12 @@ class TelegramBot:
 
                 if state['action'] == 'login':
                     # Send a request to the Raspberry Pi Flask server to check the login credentials
-                    response = self.authenticate_user(username, password)
-                    if response and response.status_code == 200:
+                    response = await self.authenticate_user(username, password)
+                    if response and response.status == 200:
                         self.logged_in_users.add(user_id)
 
                         # Register the user's chat_id on the server
-                        self.add_chat_id(username, user_id)
+                        await self.add_chat_id(username, user_id)
                         self.chat_ids.add(user_id)
                         del self.pending_login[user_id]  # Clear pending login
                         await event.respond(f"Welcome, {username}! You are now logged in.")
@@ -238,7 +300,8 @@ class TelegramBot:
             await self.main_menu(event)
             return
         await self.bot.send_message(event.chat_id, "Here is the graph of the current fullness:")
-        file_to_send = FSInputFile("storagetank_fullness.png")
+        png = await asyncio.get_running_loop().run_in_executor(None, self.fullness_chart.get_png)
+        file_to_send = BufferedInputFile(png, filename="storagetank_fullness.png")
         await self.bot.send_document(event.chat_id, file_to_send)
 
     # This function responsible for sending a web-based real-time analyzed data 
@@ -292,8 +355,8 @@ class TelegramBot:
 
         # Make a request to the Flask server to get the list of occupants
         try:
-            response = requests.get(f"{self.flask_server_url}/who_is_in")
-            if response.status_code == 200:
+            response = await self.pi.get_shared("/who_is_in", self.who_is_in_ttl)
+            if response.status == 200:
                 occupants_data = response.json()
                 occupants_list = occupants_data.get("occupants", [])
 
@@ -311,6 +374,89 @@ class TelegramBot:
     """
     Dustbin Analyser(To get the lastest data and plot)
     """
+    async def fetch_artifact(self, site, path, filename):
+        """
+        Downloads one artifact from a site's Flask server and saves it in the site's directory.
+        Sends the validators of the previous download so an unchanged artifact costs a 304 round-trip,
+        and falls back to comparing content hashes when the server does not support them.
+        Returns the new content, or None if the artifact is unchanged or the request failed.
+        """
+        state = site.artifact_state.setdefault(path, {})
+        headers = {}
+        if state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+        if state.get('last_modified'):
+            headers['If-Modified-Since'] = state['last_modified']
+        try:
+            response = await site.pi.get(path, headers=headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Error downloading {filename} from {site.name}: {e}")
+            site.stats.error(f"{path}: {e!r}")
+            site.failed = True
+            return None
+        if response.status == 304:
+            print(f"{filename} unchanged.")
+            return None
+        if response.status != 200:
+            print(f"Failed to download {filename} from {site.name}")
+            site.stats.error(f"{path}: HTTP {response.status}")
+            site.failed = True
+            return None
+        content = response.content
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        state['etag'] = etag
+        state['last_modified'] = last_modified
+        digest = hashlib.sha256(content).digest()
+        if digest == state.get('digest'):
+            print(f"{filename} unchanged.")
+            return None
+        state['digest'] = digest
+        async with aiofiles.open(site.path(filename), 'wb') as file:
+            await file.write(content)
+        print(f"{filename} downloaded successfully.")
+        return content
+
+    async def poll_once(self):
+        """
+        One polling cycle over every site, polled concurrently with bounded parallelism.
+        """
+        await self.site_poller.poll_all(self.poll_site)
+
+    async def poll_site(self, site):
+        """
+        Polls one site: download analysis.txt and fullness.txt concurrently,
+        only new fullness data triggers alert evaluation and a new chart.
+        """
+        _, fullness_content = await asyncio.gather(
+            self.fetch_artifact(site, "/get_analysis", "analysis.txt"),
+            self.fetch_artifact(site, "/get_fullness_txt", "fullness.txt"),
+        )
+        if fullness_content is not None:
+            store = site.fullness_store
+            store.update_from_text(fullness_content.decode())
+            fullness_list, name_list = store.snapshot()
+            loop = asyncio.get_running_loop()
+            # Learning saves the online models to disk, so it runs off the event loop like the store append
+            pending = [loop.run_in_executor(None, site.model_registry.observe,
+                                            name_list, fullness_list, store.timestamp),
+                       loop.run_in_executor(None, site.timeseries_store.append_snapshot,
+                                            name_list, fullness_list, store.timestamp)]
+            if site is self.sites[0]:
+                # Only the default site keeps its chart on disk, other charts are rendered when requested
+                pending.append(loop.run_in_executor(None, site.fullness_chart.save))
+            await asyncio.gather(*pending)
+            alerts = await self.handle_alert_message(site)
+            print(f"Alerts for {site.name}:", alerts)
+            # Chats due the same lines share one dispatch
+            groups = {}
+            for chat_id, message_list in alerts.items():
+                groups.setdefault(tuple(message_list), []).append(chat_id)
+            reports = await asyncio.gather(*(self.alert_dispatcher.dispatch(chat_ids, list(message_list))
+                                             for message_list, chat_ids in groups.items()))
+            for report in reports:
+                print("Alert delivery:", report)
+
     async def periodic_task(self):
         while True:
             self.count += 1
@@ -319,86 +465,60 @@ class TelegramBot:
                 print("pending", self.pending_login)
                 print("logged in", self.logged_in_users)
             else:
-                # load the analysis.txt and storagetank_fullness.png
-                # Download analysis.txt
-                analysis_response = requests.get(f"{self.flask_server_url}/get_analysis")
-                if analysis_response.status_code == 200:
-                    with open('analysis.txt', 'wb') as file:
-                        file.write(analysis_response.content)
-                    print("analysis.txt downloaded successfully.")
-                else:
-                    print("Failed to download analysis.txt")
-
-                # Download storagetank_fullness.png
-                image_response = requests.get(f"{self.flask_server_url}/get_fullness_image")
-                if image_response.status_code == 200:
-                    with open('storagetank_fullness.png', 'wb') as file:
-                        file.write(image_response.content)
-                    print("storagetank_fullness.png downloaded successfully.")
-                else:
-                    print("Failed to download storagetank_fullness.png")
-                
-                # Get fullness.txt from Flask API
-                response_txt = requests.get(f"{self.flask_server_url}/get_fullness_txt")
-                if response_txt.status_code == 200:
-                    with open('fullness.txt', 'wb') as f:
-                        f.write(response_txt.content)  # Save the fullness.txt locally
-                    print("fullness.txt downloaded successfully.")
-                    message_list = self.handle_alert_message()
-                    print("Message list:", message_list)
-                    print("CHAT IDS:", self.chat_ids)
-                    if message_list:
-                        for message in message_list:
-                            for chat_id in self.chat_ids:
-                                await self.bot.send_message(chat_id, message)
-                else:
-                    print("Failed to fullness.txt")
-                    
-                                
+                started = time.perf_counter()
+                await self.poll_once()
+                elapsed = time.perf_counter() - started
+                poll_cycle_latency.observe(elapsed)
+                if elapsed > self.interval:
+                    cycle_overruns.inc()
+
             await asyncio.sleep(self.interval)
-                        
-    
-    def handle_alert_message(self):
-        # Open the file for reading
-        message_list = []
-        fullness_list, name_list = read_fullness()
-        # message_list.append("Alert ! ! !")
-        # with open('fullness.txt', 'r') as file:
-        #     for line in file:
-        #         line = line.strip()
-        #         name, fullness = line.split()
-        #         # Convert fullness to a float
-        #         fullness = float(fullness)
-        #         # Print the results (or do something with them)
-        #         # print(f"Item: {name}, Fullness: {fullness}")
-        for i in range(len(fullness_list)):
-            # if (fullness_list[i] < self.fullness_alert_threshold):
-            #     if i == 0:
-            #         message_list.append("Alert ! ! !")
-            #     message = f"The stock of {name_list[i]} is running low at {fullness_list[i]:.2f}%. Please consider restocking soon."
-            #     message_list.append(message)
-            #     depletion_time = predict_useuptime(fullness_list[i], self.model_list[i], False)
-            #     if depletion_time < self.depletion_alert_threshold:
-            #         day, hour, minute = convert_minutes(depletion_time)
-            #         message = f"{name_list[i]} will be depleted in {day} days {hour} hours {minute} minutes. Please restock soon."
-            #         message_list.append(message)
-            current_fullness = fullness_list[i]
-            depletion_time = predict_useuptime(current_fullness, self.model_list[i], False)
-            if depletion_time < self.depletion_alert_threshold:
-                if i == 0:
-                    message_list.append("Alert ! ! !")
+
+    async def forecast_site(self, site, fullness_list, name_list):
+        # Sharded across the forecast pool when there is one, otherwise computed in the event loop
+        if self.forecast_pool is not None:
+            return await self.forecast_pool.forecast_async(site.id, fullness_list, name_list, site.model_registry)
+        return forecast_all(fullness_list, site.model_registry.models_for(name_list))
+
+    async def handle_alert_message(self, site, now=None):
+        """
+        Returns the alert lines due for each chat about one site, as {chat_id: message_list}. Chats
+        already told about a tank are skipped until the re-alert interval passes or the forecast worsens.
+        """
+        chat_ids = set(self.chat_ids)
+        if not chat_ids:
+            return {}
+        fullness_list, name_list = site.fullness_store.snapshot()
+        _, depletion_list, _ = await self.forecast_site(site, fullness_list, name_list)
+        messages = {}
+        for name, fullness, depletion_time in zip(name_list, fullness_list, depletion_list):
+            due = self.alert_policy.evaluate((site.id, name), fullness, depletion_time, chat_ids, now)
+            if not due:
+                continue
+            tank_lines = []
+            if fullness < self.fullness_alert_threshold:
+                tank_lines.append(f"The stock of {name} is running low at {fullness:.2f}%. Please consider restocking soon.")
+            if depletion_time is not None and depletion_time < self.depletion_alert_threshold:
                 day, hour, minute = convert_minutes(depletion_time)
-                message = f"{name_list[i]} will be depleted in {day} days {hour} hours {minute} minutes. Please restock soon."
-                message_list.append(message)
-            
-        # print(message_list)
-        return message_list
+                tank_lines.append(f"{name} will be depleted in {day} days {hour} hours {minute} minutes. Please restock soon.")
+            for chat_id, reason in due:
+                message_list = messages.setdefault(chat_id, ["Alert ! ! !" if len(self.sites) == 1
+                                                             else f"Alert ! ! ! ({site.name})"])
+                if reason == 'escalated':
+                    message_list.append(f"The forecast for {name} has worsened.")
+                message_list.extend(tank_lines)
+        return messages
                     
     """
     Bot operations 
     """
     # This function is responsible to start listening from the telegram client 
     async def run(self):
+        # Warm the models in worker threads while the client connects
+        for site in self.sites:
+            asyncio.get_running_loop().run_in_executor(None, site.model_registry.load_all)
+        if self.forecast_pool is not None:
+            asyncio.get_running_loop().run_in_executor(None, self.forecast_pool.warm_up)
         # Start the client in the main thread
         await self.client.start()
         await self.client.run_until_disconnected()
\ No newline at end of file
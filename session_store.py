@@ -0,0 +1,110 @@
+import json
+import sqlite3
+import threading
+
+class SessionStore:
+    """
+    Embedded SQLite store (WAL mode) for the bot's per-user state, so logins survive a restart.
+    Each collection keeps a write-through in-memory copy: lookups never touch the database and
+    every change is written immediately.
+    """
+    def __init__(self, path='bot_state.db'):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.lock = threading.Lock()
+
+    def set(self, table):
+        return PersistentSet(self, table)
+
+    def dict(self, table):
+        return PersistentDict(self, table)
+
+    def execute(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters)
+
+    def close(self):
+        self.connection.close()
+
+
+class PersistentSet:
+    """
+    Set of integer IDs backed by a table.
+    """
+    def __init__(self, store, table):
+        self.store = store
+        self.table = table
+        store.execute(f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY)")
+        self._items = {row[0] for row in store.execute(f"SELECT id FROM {table}")}
+
+    def add(self, item):
+        if item not in self._items:
+            self.store.execute(f"INSERT OR IGNORE INTO {self.table} (id) VALUES (?)", (item,))
+            self._items.add(item)
+
+    def discard(self, item):
+        if item in self._items:
+            self.store.execute(f"DELETE FROM {self.table} WHERE id = ?", (item,))
+            self._items.discard(item)
+
+    def remove(self, item):
+        if item not in self._items:
+            raise KeyError(item)
+        self.discard(item)
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        return repr(self._items)
+
+
+class PersistentDict:
+    """
+    Mapping of integer IDs to JSON-serializable values backed by a table.
+    Values are copied on write, so a value read back and modified is persisted only when assigned again.
+    """
+    def __init__(self, store, table):
+        self.store = store
+        self.table = table
+        store.execute(f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, value TEXT NOT NULL)")
+        self._items = {row[0]: json.loads(row[1]) for row in store.execute(f"SELECT id, value FROM {table}")}
+
+    def __setitem__(self, key, value):
+        serialized = json.dumps(value)
+        self.store.execute(f"INSERT OR REPLACE INTO {self.table} (id, value) VALUES (?, ?)", (key, serialized))
+        # Keep what was persisted, later changes to `value` must not show up only in memory
+        self._items[key] = json.loads(serialized)
+
+    def __getitem__(self, key):
+        return self._items[key]
+
+    def __delitem__(self, key):
+        del self._items[key]
+        self.store.execute(f"DELETE FROM {self.table} WHERE id = ?", (key,))
+
+    def get(self, key, default=None):
+        return self._items.get(key, default)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+    def __len__(self):
+        return len(self._items)
+
+    def items(self):
+        return list(self._items.items())
+
+    def __repr__(self):
+        return repr(self._items)
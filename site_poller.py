@@ -0,0 +1,116 @@
+import asyncio
+import os
+import time
+from fullness_store import FullnessStore, fullness_store
+from fullness_chart import FullnessChart
+from timeseries_store import TimeSeriesStore
+from model_socket import ModelRegistry
+from pi_client import PiClient
+from metrics import site_poll_latency, site_poll_errors
+
+class SiteStats:
+    """
+    Poll latency and error counts of one site.
+    """
+    def __init__(self, site_id):
+        self.site_id = site_id
+        self.polls = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = None
+        self.last_error = None
+        self.last_success = None
+
+    def record(self, latency, failed=False):
+        self.polls += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.last_latency = latency
+        if not failed:
+            self.last_success = time.time()
+        site_poll_latency.observe(latency, site=self.site_id)
+
+    def error(self, message):
+        self.errors += 1
+        self.last_error = message
+        site_poll_errors.inc(site=self.site_id)
+
+    def as_dict(self):
+        return {
+            "polls": self.polls,
+            "errors": self.errors,
+            "mean_latency": self.total_latency / self.polls if self.polls else None,
+            "max_latency": self.max_latency,
+            "last_latency": self.last_latency,
+            "last_error": self.last_error,
+            "last_success": self.last_success,
+        }
+
+
+class Site:
+    """
+    One warehouse: the client of its Raspberry Pi, its latest fullness snapshot and model set, its
+    downloaded artifacts and its poll stats. The default site keeps the original file locations
+    (and the shared fullness_store) so the dashboard keeps reading them; other sites live under sites/<id>/.
+    """
+    def __init__(self, info, request_timeout=10, max_concurrent_requests=20, keepalive_timeout=60,
+                 persist_online=False, default=False):
+        self.id = info["id"]
+        self.name = info["name"]
+        self.base_url = f"http://{info['ip']}:{info['port_num']}"
+        self.pi = PiClient(self.base_url, request_timeout, max_concurrent_requests, keepalive_timeout)
+        self.directory = '.' if default else os.path.join('sites', self.id)
+        os.makedirs(self.directory, exist_ok=True)
+        self.fullness_store = fullness_store if default else FullnessStore()
+        self.storage_tanks = info["storage_tanks"]
+        self.model_registry = ModelRegistry(self.storage_tanks, persist_online=persist_online)
+        self.fullness_chart = FullnessChart(self.fullness_store)
+        self.timeseries_store = TimeSeriesStore(os.path.join(self.directory, 'timeseries'))
+        self.artifact_state = {}  # Validators and content hash of the last download, per artifact path
+        self.stats = SiteStats(self.id)
+        self.failed = False  # Set when a request of the current poll failed
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    async def close(self):
+        await self.pi.close()
+
+
+def load_sites(configReader, request_timeout=10, max_concurrent_requests=20, keepalive_timeout=60, persist_online=False):
+    """
+    Builds a Site for every site in the config, the default site first.
+    """
+    return [Site(info, request_timeout, max_concurrent_requests, keepalive_timeout, persist_online, default=index == 0)
+            for index, info in enumerate(configReader.get_site_info())]
+
+
+class SitePoller:
+    """
+    Polls every site concurrently, at most `max_parallel` at a time, and records per-site latency
+    and errors. A slow or failing site only delays the sites waiting for its slot.
+    """
+    def __init__(self, sites, max_parallel=8):
+        self.sites = sites
+        self.max_parallel = max_parallel
+
+    async def poll_all(self, poll_site):
+        semaphore = asyncio.Semaphore(self.max_parallel)
+
+        async def poll(site):
+            async with semaphore:
+                site.failed = False
+                started = time.perf_counter()
+                try:
+                    await poll_site(site)
+                except Exception as e:
+                    print(f"Error polling site {site.name}: {e}")
+                    site.stats.error(str(e))
+                    site.failed = True
+                site.stats.record(time.perf_counter() - started, site.failed)
+
+        await asyncio.gather(*(poll(site) for site in self.sites))
+
+    def stats(self):
+        return {site.id: site.stats.as_dict() for site in self.sites}
@@ -0,0 +1,35 @@
+import os
+import shutil
+from datetime import datetime
+import joblib
+import numpy as np
+import pytest
+import forecast_pool
+from model_socket import forecast_all
+
+pytestmark = pytest.mark.filterwarnings("ignore::UserWarning")
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "model")
+NOW = datetime(2026, 10, 18, 13, 37)
+
+def expected(model_name, level):
+    roc_list, depletion_list, _ = forecast_all([level], [joblib.load(os.path.join(MODEL_DIR, model_name))], NOW)
+    return roc_list[0], depletion_list[0]
+
+def test_worker_forecasts_follow_a_reloaded_model(tmp_path, monkeypatch):
+    shutil.copy(os.path.join(MODEL_DIR, "model1.pkl"), tmp_path / "tank.pkl")
+    monkeypatch.setattr(forecast_pool, "_worker_sites", {})
+    forecast_pool._init_worker({"main": [{"tag": '"Grains"', "model": "tank.pkl"}]}, str(tmp_path), False)
+    registry, _ = forecast_pool._worker_sites["main"]
+    registry.check_interval = 0
+
+    roc, depletion = forecast_pool._forecast_shard("main", np.array([0]), np.array([50.0]), NOW)
+    assert (roc[0], depletion[0]) == expected("model1.pkl", 50.0)
+
+    # A retrained model replaces the file, the next forecast must use it
+    shutil.copy(os.path.join(MODEL_DIR, "model2.pkl"), tmp_path / "tank.pkl")
+    mtime = os.path.getmtime(tmp_path / "tank.pkl") + 10
+    os.utime(tmp_path / "tank.pkl", (mtime, mtime))
+    roc, depletion = forecast_pool._forecast_shard("main", np.array([0]), np.array([50.0]), NOW)
+    assert (roc[0], depletion[0]) == expected("model2.pkl", 50.0)
+    assert expected("model1.pkl", 50.0) != expected("model2.pkl", 50.0)
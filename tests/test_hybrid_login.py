@@ -0,0 +1,31 @@
+import http_server
+from pi_standin import create_app, serve_in_thread
+
+DATA = {"username": "alice", "password": "password"}
+
+def use_standin(monkeypatch, server):
+    monkeypatch.setattr(http_server, "raspi_url", f"http://127.0.0.1:{server.server_port}")
+
+def test_login_after_pi_restart_with_new_key(monkeypatch):
+    monkeypatch.setattr(http_server, "hybrid_encryption", True)
+    monkeypatch.setattr(http_server, "public_key", None)
+    monkeypatch.setattr(http_server, "session_key", None)
+    server = serve_in_thread(create_app(), 0)
+    port = server.server_port
+    try:
+        use_standin(monkeypatch, server)
+        assert http_server.authenticate_user(DATA).status_code == 200
+        assert http_server.session_key.acknowledged
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # The restarted Pi has a new key pair and no cached session keys
+    server = serve_in_thread(create_app(), port)
+    try:
+        use_standin(monkeypatch, server)
+        assert http_server.authenticate_user(DATA).status_code == 200
+        assert http_server.authenticate_user(DATA).status_code == 200
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,64 @@
+import os
+from datetime import datetime
+import joblib
+import numpy as np
+import pytest
+from model_socket import (NO_MODEL, ModelRegistry, RateTable, day_to_index, forecast_all, forecast_cache,
+                          minute_of_week, predict_useuptime)
+
+# sklearn warns about missing feature names on every single-row predict
+pytestmark = pytest.mark.filterwarnings("ignore::UserWarning")
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "model")
+
+def original_useuptime(current_inventory_level, model, now):
+    # The per-minute loop the rate tables replaced, one model.predict call per simulated minute
+    time_elapsed = 0
+    minute_of_day = now.minute + now.hour * 60
+    weekday = day_to_index(now.strftime("%A"))
+    while current_inventory_level > 0:
+        predicted_rate_of_change = model.predict(np.array([[minute_of_day, weekday]]))[0]
+        if predicted_rate_of_change < 0:
+            current_inventory_level += predicted_rate_of_change
+        time_elapsed += 1
+        minute_of_day = (minute_of_day + 1) % 1440
+        if minute_of_day == 0:
+            weekday = (weekday + 1) % 7
+    return time_elapsed
+
+CASES = [
+    ("model1.pkl", datetime(2026, 10, 18, 13, 37), 99.987),
+    ("model1.pkl", datetime(2026, 10, 17, 23, 59), 12.345),
+    ("model2.pkl", datetime(2026, 10, 19, 0, 0), 57.5),
+    ("model3.pkl", datetime(2026, 10, 21, 6, 15), 3.001),
+    ("model4.pkl", datetime(2026, 10, 23, 18, 45), 80.004),
+]
+
+@pytest.fixture(scope="module")
+def models():
+    return {name: joblib.load(os.path.join(MODEL_DIR, name)) for name in {case[0] for case in CASES}}
+
+@pytest.mark.parametrize("model_name, now, level", CASES)
+def test_forecasts_match_the_original_loop(models, model_name, now, level):
+    model = models[model_name]
+    expected = original_useuptime(level, model, now)
+    forecast_cache.clear()
+    assert RateTable(model).minutes_until_depleted(level, minute_of_week(now)) == expected
+    assert predict_useuptime(level, model, False, now=now) == expected
+    forecast_cache.clear()
+    assert forecast_all([level], [model], now)[1] == [expected]
+
+def test_cache_hits_do_not_reuse_a_nearby_level(models):
+    model = models["model1.pkl"]
+    now = datetime(2026, 10, 18, 13, 37)
+    forecast_cache.clear()
+    predict_useuptime(99.99, model, False, now=now)
+    assert predict_useuptime(99.987, model, False, now=now) == original_useuptime(99.987, model, now)
+
+def test_unconfigured_tank_is_reported_without_a_model():
+    registry = ModelRegistry([{"tag": '"Grains"', "model": "model1.pkl"}], MODEL_DIR)
+    names = ['"Grains"', '"Unknown"']
+    roc_list, depletion_list, depletion_str_list = forecast_all([50.0, 50.0], registry.models_for(names),
+                                                                 datetime(2026, 10, 18, 13, 37), names)
+    assert depletion_list[0] is not None and depletion_str_list[0] != NO_MODEL
+    assert (roc_list[1], depletion_list[1], depletion_str_list[1]) == (0.0, None, NO_MODEL)
@@ -0,0 +1,60 @@
+import asyncio
+from config_reader import ConfigReader
+from pi_standin import serve_in_thread
+from thingspeak_ingester import ThingSpeakIngester
+from thingspeak_standin import create_app, generate_feed
+
+CONFIG = """
+[THINGSPEAK]
+read_api_keys = KEY1,KEY2
+channel_ids = 101,102
+
+[STORAGE_TANK_1]
+depth = 10
+tag = "Grains"
+
+[STORAGE_TANK_2]
+depth = 12
+tag = "Sugar"
+"""
+
+def make_ingester(tmp_path, channels, results=8000):
+    config_path = tmp_path / "config.txt"
+    config_path.write_text(CONFIG)
+    server = serve_in_thread(create_app(channels), 0)
+    readings = {}
+
+    def writer(channel_id, tank, new_readings):
+        readings.setdefault(channel_id, []).extend(new_readings)
+
+    ingester = ThingSpeakIngester(ConfigReader(str(config_path)), storage_dir=str(tmp_path / "thingspeak"),
+                                  writer=writer, base_url=f"http://127.0.0.1:{server.server_port}", results=results)
+    return server, ingester, readings
+
+def test_first_run_backfills_the_whole_history(tmp_path):
+    channels = {"101": ("KEY1", generate_feed(20000)), "102": ("KEY2", generate_feed(500))}
+    server, ingester, readings = make_ingester(tmp_path, channels)
+    try:
+        report = asyncio.run(ingester.ingest_all())
+    finally:
+        server.shutdown()
+    assert report == {"101": 20000, "102": 500}
+    assert [reading[0] for reading in readings["101"]] == list(range(1, 20001))
+    assert [reading[0] for reading in readings["102"]] == list(range(1, 501))
+    assert ingester.state["101"]["last_entry_id"] == 20000
+
+def test_resume_fetches_only_new_entries_across_pages(tmp_path):
+    feed = generate_feed(3000)
+    channels = {"101": ("KEY1", feed[:1000]), "102": ("KEY2", [])}
+    server, ingester, readings = make_ingester(tmp_path, channels, results=400)
+    try:
+        asyncio.run(ingester.ingest_all())
+        # 2000 new entries arrive, more than four pages behind the newest one
+        channels["101"][1].extend(feed[1000:])
+        report = asyncio.run(ingester.ingest_all())
+        again = asyncio.run(ingester.ingest_all())
+    finally:
+        server.shutdown()
+    assert report["101"] == 2000
+    assert again["101"] == 0
+    assert [reading[0] for reading in readings["101"]] == list(range(1, 3001))
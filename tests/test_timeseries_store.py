@@ -0,0 +1,32 @@
+import multiprocessing
+import numpy as np
+from timeseries_store import TimeSeriesStore
+
+def write_readings(root, tank, offset, count):
+    store = TimeSeriesStore(root, segment_size=64)
+    for i in range(count):
+        store.append(tank, [offset + i], [float(i)])
+
+def test_reader_sees_rows_written_by_another_store(tmp_path):
+    root = str(tmp_path / "timeseries")
+    reader = TimeSeriesStore(root, segment_size=64)
+    writer = TimeSeriesStore(root, segment_size=64)
+    writer.append_snapshot(['"Grains"', '"Sugar"'], [50.0, 60.0], timestamp=1000.0)
+    writer.append('"Grains"', np.arange(2000.0, 2100.0), np.arange(100.0))
+    timestamps, fullness = reader.query('"Grains"')
+    assert len(timestamps) == 101
+    assert fullness[0] == 50.0
+    assert reader.tanks() == ['"Grains"', '"Sugar"']
+
+def test_concurrent_writer_processes_keep_every_row(tmp_path):
+    root = str(tmp_path / "timeseries")
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=write_readings, args=(root, f"tank{i}", i * 10000, 150)) for i in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    store = TimeSeriesStore(root)
+    for i in range(3):
+        timestamps, _ = store.query(f"tank{i}")
+        assert np.array_equal(timestamps, np.arange(i * 10000, i * 10000 + 150, dtype=np.float64))
@@ -0,0 +1,141 @@
+import asyncio
+import csv
+import json
+import os
+from datetime import datetime, timezone
+import aiohttp
+from config_reader import ConfigReader, DEFAULT_SITE
+
+THINGSPEAK_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+def parse_thingspeak_time(value):
+    return datetime.strptime(value, THINGSPEAK_TIME_FORMAT).replace(tzinfo=timezone.utc)
+
+
+class CsvReadingWriter:
+    """
+    Appends readings as (entry_id, timestamp, tank, fullness) rows to one CSV file per channel.
+    """
+    def __init__(self, storage_dir):
+        self.storage_dir = storage_dir
+
+    def __call__(self, channel_id, tank, readings):
+        path = os.path.join(self.storage_dir, f"{channel_id}.csv")
+        new_file = not os.path.exists(path)
+        with open(path, 'a', newline='') as file:
+            writer = csv.writer(file)
+            if new_file:
+                writer.writerow(["entry_id", "timestamp", "tank", "fullness"])
+            for entry_id, timestamp, fullness in readings:
+                writer.writerow([entry_id, timestamp, tank, fullness])
+
+
+class ThingSpeakIngester:
+    """
+    Pulls the feed of every configured ThingSpeak channel in bulk, resuming after the last entry ID
+    seen for each channel, and hands the new readings to a writer. Channels are polled concurrently.
+    Channel i belongs to the i-th STORAGE_TANK_* section of the default site.
+    """
+    def __init__(self, configReader: ConfigReader, storage_dir='thingspeak', writer=None,
+                 base_url=None, max_concurrency=4, results=8000, timeout=10):
+        read_api_keys, _, _, channel_ids = configReader.get_thingspeak_info()
+        tags = [tank["tag"] for tank in configReader.get_storagetank_info(DEFAULT_SITE)]
+        self.channels = list(zip(channel_ids, read_api_keys, tags))
+        self.field = configReader.get_param('THINGSPEAK', 'field') or 'field1'
+        self.base_url = base_url or configReader.get_param('THINGSPEAK', 'base_url') or "https://api.thingspeak.com"
+        self.storage_dir = storage_dir
+        os.makedirs(storage_dir, exist_ok=True)
+        self.writer = writer if writer is not None else CsvReadingWriter(storage_dir)
+        self.results = results
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.state_path = os.path.join(storage_dir, "state.json")
+        self.state = self._load_state()
+
+    def _load_state(self):
+        # Last entry ID and timestamp ingested per channel
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r') as file:
+                return json.load(file)
+        return {}
+
+    def _save_state(self):
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(self.state, file)
+        os.replace(temp_path, self.state_path)
+
+    async def fetch_page(self, session, channel_id, api_key, end=None):
+        # Newest `results` entries of the channel, or the newest ones created at or before `end`
+        params = {"api_key": api_key, "results": self.results, "timezone": "Etc/UTC"}
+        if end is not None:
+            params["end"] = end.strftime("%Y-%m-%d %H:%M:%S")
+        async with session.get(f"{self.base_url}/channels/{channel_id}/feeds.json", params=params) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def ingest_channel(self, session, channel_id, api_key, tank):
+        """
+        Fetches every entry newer than the last one ingested for the channel. Pages are walked
+        backwards from the newest entry with `end` windows until the page reaches the entry after
+        the last ingested one (or entry 1 on the first run), so neither a first backfill nor a gap
+        in the feed loses entries. Returns the number of new readings.
+        """
+        channel_state = self.state.setdefault(channel_id, {"last_entry_id": 0, "last_created_at": None})
+        last_entry_id = channel_state["last_entry_id"]
+        new_feeds = {}
+        end = None
+        async with self.semaphore:
+            while True:
+                page = await self.fetch_page(session, channel_id, api_key, end)
+                feeds = [feed for feed in page.get("feeds", []) if feed["entry_id"] > last_entry_id]
+                oldest = min(feeds, key=lambda feed: feed["entry_id"], default=None)
+                older = [feed for feed in feeds if feed["entry_id"] not in new_feeds]
+                for feed in older:
+                    new_feeds[feed["entry_id"]] = feed
+                # Done once the page reaches the entry after the last ingested one, or has nothing older
+                if oldest is None or not older or oldest["entry_id"] <= last_entry_id + 1:
+                    break
+                # `end` is inclusive, entries of the oldest second that were already seen are skipped above
+                end = parse_thingspeak_time(oldest["created_at"])
+        readings = []
+        for entry_id in sorted(new_feeds):
+            feed = new_feeds[entry_id]
+            value = feed.get(self.field)
+            if value is None or value == "":
+                continue
+            timestamp = parse_thingspeak_time(feed["created_at"]).timestamp()
+            readings.append((entry_id, timestamp, float(value)))
+        if readings:
+            self.writer(channel_id, tank, readings)
+        if new_feeds:
+            newest = new_feeds[max(new_feeds)]
+            channel_state["last_entry_id"] = newest["entry_id"]
+            channel_state["last_created_at"] = newest["created_at"]
+        return len(readings)
+
+    async def ingest_all(self):
+        """
+        Ingests all channels concurrently and saves the resume state.
+        Returns {channel_id: number of new readings, or the error if the channel failed}.
+        """
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            results = await asyncio.gather(
+                *(self.ingest_channel(session, channel_id, api_key, tank)
+                  for channel_id, api_key, tank in self.channels),
+                return_exceptions=True,
+            )
+        self._save_state()
+        return {channel_id: result for (channel_id, _, _), result in zip(self.channels, results)}
+
+    async def run(self, interval=60):
+        while True:
+            print("ThingSpeak ingestion:", await self.ingest_all())
+            await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    from timeseries_store import TimeSeriesStore
+    ingester = ThingSpeakIngester(ConfigReader(), writer=TimeSeriesStore('timeseries').ingest_writer)
+    print(asyncio.run(ingester.ingest_all()))
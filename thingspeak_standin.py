@@ -0,0 +1,65 @@
+"""
+Local stand-in for the ThingSpeak channel feed API, for testing the ingester offline.
+
+    python thingspeak_standin.py            # serves synthetic feeds for the configured channels on port 5100
+
+Then point the ingester at it with base_url = http://127.0.0.1:5100 in the [THINGSPEAK] section.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+from flask import Flask, request, jsonify
+from config_reader import ConfigReader
+
+def generate_feed(count, start=None, interval_seconds=15, field='field1'):
+    # Synthetic fullness readings that drain slowly and are refilled when they run low
+    if start is None:
+        start = datetime.now(timezone.utc) - timedelta(seconds=count * interval_seconds)
+    fullness = random.uniform(40, 100)
+    feed = []
+    for entry_id in range(1, count + 1):
+        fullness -= random.uniform(0, 0.2)
+        if fullness < 5:
+            fullness = 100.0
+        created_at = start + timedelta(seconds=entry_id * interval_seconds)
+        feed.append({"created_at": created_at.strftime("%Y-%m-%dT%H:%M:%SZ"), "entry_id": entry_id,
+                     field: f"{fullness:.2f}"})
+    return feed
+
+def create_app(channels):
+    """
+    `channels` maps channel ID to (read API key, list of feed entries). Entries can be appended to the
+    lists while the app is running to simulate new readings.
+    """
+    app = Flask(__name__)
+    app.request_count = 0
+
+    @app.route('/channels/<channel_id>/feeds.json')
+    def feeds(channel_id):
+        app.request_count += 1
+        if channel_id not in channels:
+            return jsonify(-1), 404
+        api_key, feed = channels[channel_id]
+        if request.args.get('api_key') != api_key:
+            return jsonify(-1), 400
+        results = min(int(request.args.get('results', 100)), 8000)
+        entries = feed
+        start = request.args.get('start')
+        end = request.args.get('end')
+        if start:
+            start_time = datetime.strptime(start, "%Y-%m-%d %H:%M:%S").strftime("%Y-%m-%dT%H:%M:%SZ")
+            entries = [entry for entry in entries if entry["created_at"] >= start_time]
+        if end:
+            end_time = datetime.strptime(end, "%Y-%m-%d %H:%M:%S").strftime("%Y-%m-%dT%H:%M:%SZ")
+            entries = [entry for entry in entries if entry["created_at"] <= end_time]
+        # Like ThingSpeak, the newest `results` entries of the window, oldest first
+        entries = entries[-results:]
+        last_entry_id = feed[-1]["entry_id"] if feed else None
+        return jsonify({"channel": {"id": int(channel_id), "last_entry_id": last_entry_id}, "feeds": entries})
+
+    return app
+
+
+if __name__ == "__main__":
+    read_api_keys, _, _, channel_ids = ConfigReader().get_thingspeak_info()
+    channels = {channel_id: (api_key, generate_feed(20000)) for channel_id, api_key in zip(channel_ids, read_api_keys)}
+    create_app(channels).run(host='127.0.0.1', port=5100, threaded=True)
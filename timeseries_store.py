@@ -0,0 +1,286 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no inter-process lock, run a single writer per directory
+    fcntl = None
+
+ROLLUP_SECONDS = {"minute": 60, "hour": 3600, "day": 86400}
+ROLLUP_DTYPE = np.dtype([("bucket", "i8"), ("tank", "u2"), ("sum", "f8"), ("count", "u4"),
+                         ("min", "f4"), ("max", "f4")])
+COLUMNS = {"timestamp": "f8", "tank": "u2", "fullness": "f4"}
+
+def compute_rollup(timestamps, tanks, values, seconds):
+    """
+    Aggregates readings into (bucket, tank) rows with sum, count, min and max.
+    """
+    if len(values) == 0:
+        return np.empty(0, dtype=ROLLUP_DTYPE)
+    buckets = (np.floor(timestamps / seconds) * seconds).astype(np.int64)
+    keys = np.stack([buckets, tanks.astype(np.int64)])
+    unique, inverse = np.unique(keys, axis=1, return_inverse=True)
+    inverse = inverse.ravel()
+    rollup = np.empty(unique.shape[1], dtype=ROLLUP_DTYPE)
+    rollup["bucket"] = unique[0]
+    rollup["tank"] = unique[1]
+    rollup["sum"] = np.bincount(inverse, weights=values, minlength=len(rollup))
+    rollup["count"] = np.bincount(inverse, minlength=len(rollup))
+    rollup["min"] = np.inf
+    rollup["max"] = -np.inf
+    np.minimum.at(rollup["min"], inverse, values)
+    np.maximum.at(rollup["max"], inverse, values)
+    return rollup
+
+def merge_rollups(rollups):
+    # Buckets can span segment boundaries, combine rows that share a (bucket, tank)
+    rollups = [rollup for rollup in rollups if len(rollup)]
+    if not rollups:
+        return np.empty(0, dtype=ROLLUP_DTYPE)
+    rows = np.concatenate(rollups)
+    keys = np.stack([rows["bucket"], rows["tank"].astype(np.int64)])
+    unique, inverse = np.unique(keys, axis=1, return_inverse=True)
+    inverse = inverse.ravel()
+    merged = np.empty(unique.shape[1], dtype=ROLLUP_DTYPE)
+    merged["bucket"] = unique[0]
+    merged["tank"] = unique[1]
+    merged["sum"] = np.bincount(inverse, weights=rows["sum"], minlength=len(merged))
+    merged["count"] = np.bincount(inverse, weights=rows["count"], minlength=len(merged))
+    merged["min"] = np.inf
+    merged["max"] = -np.inf
+    np.minimum.at(merged["min"], inverse, rows["min"])
+    np.maximum.at(merged["max"], inverse, rows["max"])
+    return merged
+
+
+class TimeSeriesStore:
+    """
+    Append-only columnar store of (timestamp, tank, fullness) readings.
+
+    Readings are written to fixed-size segments, one numpy memmap file per column, so queries only
+    page in the segments that overlap the requested time range. When a segment fills up it is sealed
+    and its minute/hour/day rollups are computed once and saved next to it. Whole segments older
+    than the retention period are deleted.
+
+    Several processes can share a directory (the bot, the ThingSpeak ingester and the dashboard):
+    writers hold a file lock and start from the latest meta.json, readers reload meta.json when it
+    has been replaced.
+    """
+    def __init__(self, root='timeseries', segment_size=1 << 16, retention_days=None):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.meta_path = os.path.join(root, "meta.json")
+        self.lock_path = os.path.join(root, "write.lock")
+        self._lock = threading.RLock()
+        self._meta_stamp = None
+        self.meta = {"segment_size": segment_size, "tanks": {}, "segments": [], "next_segment": 0}
+        self.segment_size = segment_size
+        self._refresh_meta()
+        self.retention_seconds = retention_days * 86400 if retention_days is not None else None
+
+    def _refresh_meta(self):
+        # meta.json is replaced atomically on every write, so a new inode or mtime means new data
+        try:
+            stat = os.stat(self.meta_path)
+        except FileNotFoundError:
+            return
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp == self._meta_stamp:
+            return
+        with open(self.meta_path, 'r') as file:
+            self.meta = json.load(file)
+        self.segment_size = self.meta["segment_size"]
+        self._meta_stamp = stamp
+
+    @contextmanager
+    def _writer_lock(self):
+        # Serializes writers within this process and across processes, readers never wait for it
+        with self._lock, open(self.lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save_meta(self):
+        temp_path = self.meta_path + ".tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(self.meta, file)
+        os.replace(temp_path, self.meta_path)
+        stat = os.stat(self.meta_path)
+        self._meta_stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _column_path(self, segment_id, column):
+        return os.path.join(self.root, f"seg_{segment_id:06d}.{column}")
+
+    def _column(self, segment, column, mode='r'):
+        return np.memmap(self._column_path(segment["id"], column), dtype=COLUMNS[column], mode=mode,
+                         shape=(self.segment_size,))
+
+    def _new_segment(self):
+        segment = {"id": self.meta["next_segment"], "count": 0, "min_ts": None, "max_ts": None, "sealed": False}
+        self.meta["next_segment"] += 1
+        for column in COLUMNS:
+            # Preallocate the whole segment, appends only write into it
+            self._column(segment, column, mode='w+').flush()
+        self.meta["segments"].append(segment)
+        return segment
+
+    def tank_id(self, tank):
+        tanks = self.meta["tanks"]
+        if tank not in tanks:
+            tanks[tank] = len(tanks)
+        return tanks[tank]
+
+    def append(self, tank, timestamps, fullness):
+        """
+        Appends readings of one tank. Returns the number of readings written.
+        """
+        return self._append([tank], np.zeros(len(timestamps), dtype=np.intp), timestamps, fullness)
+
+    def append_snapshot(self, name_list, fullness_list, timestamp=None):
+        # One reading per tank at the same time, e.g. a fullness.txt poll, written in a single append
+        if timestamp is None:
+            timestamp = time.time()
+        return self._append(list(name_list), np.arange(len(name_list)),
+                            np.full(len(name_list), timestamp), fullness_list)
+
+    def _append(self, names, name_index, timestamps, fullness):
+        # Row i belongs to tank names[name_index[i]]
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        fullness = np.asarray(fullness, dtype=np.float32)
+        if len(timestamps) == 0:
+            return 0
+        with self._writer_lock():
+            self._refresh_meta()
+            tank_ids = np.array([self.tank_id(name) for name in names], dtype=np.uint16)[name_index]
+            written = 0
+            while written < len(timestamps):
+                segment = self.meta["segments"][-1] if self.meta["segments"] else None
+                if segment is None or segment["sealed"]:
+                    segment = self._new_segment()
+                begin = segment["count"]
+                count = min(self.segment_size - begin, len(timestamps) - written)
+                chunk = slice(written, written + count)
+                for column, values in (("timestamp", timestamps), ("tank", tank_ids), ("fullness", fullness)):
+                    memmap = self._column(segment, column, mode='r+')
+                    memmap[begin:begin + count] = values[chunk]
+                    memmap.flush()
+                chunk_min, chunk_max = float(timestamps[chunk].min()), float(timestamps[chunk].max())
+                segment["min_ts"] = chunk_min if segment["min_ts"] is None else min(segment["min_ts"], chunk_min)
+                segment["max_ts"] = chunk_max if segment["max_ts"] is None else max(segment["max_ts"], chunk_max)
+                segment["count"] = begin + count
+                if segment["count"] == self.segment_size:
+                    self._seal(segment)
+                written += count
+            self._apply_retention()
+            self._save_meta()
+            return written
+
+    def ingest_writer(self, channel_id, tank, readings):
+        # Writer interface of ThingSpeakIngester
+        _, timestamps, fullness = zip(*readings)
+        self.append(tank, timestamps, fullness)
+
+    def _seal(self, segment):
+        segment["sealed"] = True
+        timestamps, tanks, values = self._read_segment(segment)
+        for resolution, seconds in ROLLUP_SECONDS.items():
+            np.save(self._column_path(segment["id"], f"{resolution}.npy"),
+                    compute_rollup(timestamps, tanks, values, seconds))
+
+    def _apply_retention(self):
+        if self.retention_seconds is None:
+            return
+        cutoff = time.time() - self.retention_seconds
+        kept = []
+        for segment in self.meta["segments"]:
+            if segment["sealed"] and segment["max_ts"] is not None and segment["max_ts"] < cutoff:
+                for name in list(COLUMNS) + [f"{resolution}.npy" for resolution in ROLLUP_SECONDS]:
+                    path = self._column_path(segment["id"], name)
+                    if os.path.exists(path):
+                        os.remove(path)
+            else:
+                kept.append(segment)
+        self.meta["segments"] = kept
+
+    def _read_segment(self, segment):
+        count = segment["count"]
+        return tuple(self._column(segment, column)[:count] for column in COLUMNS)
+
+    def _segments_in_range(self, start, end):
+        for segment in list(self.meta["segments"]):
+            if segment["count"] == 0:
+                continue
+            if start is not None and segment["max_ts"] < start:
+                continue
+            if end is not None and segment["min_ts"] >= end:
+                continue
+            yield segment
+
+    def query(self, tank, start=None, end=None):
+        """
+        Returns (timestamps, fullness) arrays of a tank's readings with start <= timestamp < end,
+        ordered by time.
+        """
+        self._refresh_meta()
+        if tank not in self.meta["tanks"]:
+            return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float32)
+        tank_id = self.meta["tanks"][tank]
+        timestamp_parts, fullness_parts = [], []
+        for segment in self._segments_in_range(start, end):
+            try:
+                timestamps, tanks, values = self._read_segment(segment)
+            except FileNotFoundError:
+                # Removed by another process's retention pass after the meta was read
+                continue
+            mask = tanks == tank_id
+            if start is not None:
+                mask &= timestamps >= start
+            if end is not None:
+                mask &= timestamps < end
+            timestamp_parts.append(np.array(timestamps[mask]))
+            fullness_parts.append(np.array(values[mask]))
+        if not timestamp_parts:
+            return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float32)
+        timestamps, fullness = np.concatenate(timestamp_parts), np.concatenate(fullness_parts)
+        order = np.argsort(timestamps, kind='stable')
+        return timestamps[order], fullness[order]
+
+    def rollup(self, tank, resolution='hour', start=None, end=None):
+        """
+        Downsampled readings of a tank: structured array with bucket start time, mean, min, max and count.
+        Sealed segments use their precomputed rollups, only the open segment is aggregated on the fly.
+        """
+        seconds = ROLLUP_SECONDS[resolution]
+        self._refresh_meta()
+        if tank not in self.meta["tanks"]:
+            return np.empty(0, dtype=ROLLUP_DTYPE)
+        tank_id = self.meta["tanks"][tank]
+        parts = []
+        for segment in self._segments_in_range(start, end):
+            if segment["sealed"]:
+                parts.append(np.load(self._column_path(segment["id"], f"{resolution}.npy"), mmap_mode='r'))
+            else:
+                parts.append(compute_rollup(*self._read_segment(segment), seconds))
+        parts = [part[part["tank"] == tank_id] for part in parts]
+        rollup = merge_rollups(parts)
+        if start is not None:
+            rollup = rollup[rollup["bucket"] + seconds > start]
+        if end is not None:
+            rollup = rollup[rollup["bucket"] < end]
+        return rollup
+
+    def tanks(self):
+        self._refresh_meta()
+        return list(self.meta["tanks"])
+
+
+def rollup_mean(rollup):
+    return rollup["sum"] / np.maximum(rollup["count"], 1)